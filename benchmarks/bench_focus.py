@@ -0,0 +1,82 @@
+"""Compare the ways ``--focus`` can put an item back into its input.
+
+Run with ``python benchmarks/bench_focus.py [items] [width]``.
+"""
+from collections import namedtuple
+import sys
+from time import perf_counter
+
+from spy import decorators
+
+
+def fragment(v, context=None):
+    return v + 1
+
+
+def make_records(items, width):
+    Record = namedtuple('Record', ['f{}'.format(i) for i in range(width)])
+    return [
+        ('dict', [{'f{}'.format(i): i for i in range(width)} for _ in range(items)], 'f1'),
+        ('list', [list(range(width)) for _ in range(items)], 1),
+        ('tuple', [tuple(range(width)) for _ in range(items)], 1),
+        ('namedtuple', [Record(*range(width)) for _ in range(items)], 1),
+    ]
+
+
+def copy_everything(fn, focus):
+    # what the fallback did before tuples were rebuilt: copy, then assign
+    def apply(f, v):
+        v_ = decorators.copy.copy(v)
+        v_[focus] = f(v_[focus])
+        return v_
+    return apply
+
+
+def without_lenses(prep):
+    def prep_(fn, focus):
+        lenses, decorators.lenses = decorators.lenses, None
+        try:
+            return prep(fn, focus)
+        finally:
+            decorators.lenses = lenses
+    return prep_
+
+
+def full_lens(fn, focus):
+    # what the lenses path did before it had compiled accessors
+    return decorators._focus_prep(fn, decorators.lenses.lens[focus])
+
+
+MODES = [
+    ('copy', copy_everything),
+    ('fallback', without_lenses(decorators._focus_prep)),
+    ('in-place', decorators._focus_in_place_prep),
+    ('lenses', decorators._focus_prep),
+    ('full lens', full_lens),
+]
+
+
+def run(prep, records, focus):
+    apply = prep(fragment, focus)
+    t = perf_counter()
+    for v in records:
+        apply(fragment, v)
+    return perf_counter() - t
+
+
+def main(items=100000, width=50):
+    decorators._get_lenses()
+    print('{:<12}'.format(''), *('{:>10}'.format(name) for name, _ in MODES))
+    for name, records, focus in make_records(items, width):
+        times = []
+        for _, prep in MODES:
+            try:
+                times.append('{:>9.3f}s'.format(run(prep, records, focus)))
+            except TypeError:
+                # tuples can't be copied and assigned to
+                times.append('{:>10}'.format('-'))
+        print('{:<12}'.format(name), *times)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
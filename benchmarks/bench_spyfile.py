@@ -0,0 +1,73 @@
+"""Compare reading through SpyFile with reading a plain io.TextIOWrapper.
+
+Run with ``python benchmarks/bench_spyfile.py [lines]``.
+"""
+import csv
+import json
+import os
+import sys
+import tempfile
+from time import perf_counter
+
+from spy.objects import MappedSpyFile, SpyFile
+
+
+def read_all(f):
+    f.read()
+
+
+def read_blocks(f):
+    while f.read(65536):
+        pass
+
+
+def read_lines(f):
+    for _ in iter(f.readline, ''):
+        pass
+
+
+def iterate(f):
+    for _ in f:
+        pass
+
+
+def csv_rows(f):
+    for _ in csv.reader(f):
+        pass
+
+
+OPENERS = [
+    ('TextIOWrapper', lambda path: open(path)),
+    ('SpyFile', lambda path: SpyFile(open(path))),
+    ('MappedSpyFile', lambda path: MappedSpyFile(path)),
+]
+
+BENCHMARKS = [read_all, read_blocks, read_lines, iterate, csv_rows]
+
+
+def run(path, opener, benchmark):
+    f = opener(path)
+    try:
+        t = perf_counter()
+        benchmark(f)
+        return perf_counter() - t
+    finally:
+        f.close()
+
+
+def main(lines=500000):
+    with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+        for i in range(lines):
+            f.write('{},{},"{}"\n'.format(i, i * i, json.dumps({'n': i})))
+    try:
+        print('{:<12}'.format(''), *('{:>14}'.format(name) for name, _ in OPENERS))
+        for benchmark in BENCHMARKS:
+            times = [run(f.name, opener, benchmark) for _, opener in OPENERS]
+            print('{:<12}'.format(benchmark.__name__),
+                  *('{:>13.3f}s'.format(t) for t in times))
+    finally:
+        os.unlink(f.name)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -1,7 +1,7 @@
 from .catcher import CaughtException, handler as catch
-from .core import DROP, chain, collect, fragment, many
+from .core import DROP, async_fragment, chain, collect, fragment, many, threaded_fragment
 
 _dont_load_plugins = False
 
-__all__ = ['CaughtException', 'catch', 'DROP', 'chain', 'collect',
-           'fragment', 'many']
+__all__ = ['CaughtException', 'catch', 'DROP', 'async_fragment', 'chain',
+           'collect', 'fragment', 'many', 'threaded_fragment']
@@ -58,6 +58,19 @@ def _format_exc(typ, exc, tb, *, delete_all=False):
                 fragment_value = (local['_spy_value'],)
             frame_kind = 'fragment'
 
+        # input decoder
+        if _in('_spy_input_line', local):
+            del entries[:]
+            frame_kind = 'input'
+            lines.append('  Input line {} ({})'.format(local['_spy_input_line'],
+                                                      local.get('_spy_input_format')))
+            record = local.get('_spy_input_record')
+            if isinstance(record, bytes):
+                record = record.decode('utf-8', 'backslashreplace')
+            if record is not None:
+                lines.append('    ' + record.rstrip('\r\n'))
+            hide_below_user = True
+
         # decorator
         if _in('_spy_decorator', local):
             if delete_in is not None:  # pragma: no branch
@@ -84,6 +97,25 @@ def _format_exc(typ, exc, tb, *, delete_all=False):
                 del entries[delete_in:]
             fragment_debuginfo = local._spy_debuginfo
             frame_kind = 'synthetic_callable'
+        # cli codegen pipeline
+        elif (type(tb.tb_frame.f_globals) is dict and
+                tb.tb_lineno in tb.tb_frame.f_globals.get('_spy_linemap', ())):
+            g = tb.tb_frame.f_globals
+            if delete_all:
+                del entries[:]
+            elif delete_in is not None:  # pragma: no cover
+                del entries[delete_in:]
+            delete_in = len(entries)
+            fragment_debuginfo, fragment_decorator = g['_spy_linemap'][tb.tb_lineno]
+            if _in(g['_spy_pipe_name'], local):  # pragma: no branch
+                fragment_value = (local[g['_spy_pipe_name']],)
+            frame_kind = 'decorator' if fragment_decorator else 'synthetic_callable'
+        # cli make_function
+        elif type(tb.tb_frame.f_globals) is dict and '_spy_debuginfo' in tb.tb_frame.f_globals:
+            if delete_in is not None:  # pragma: no branch
+                del entries[delete_in:]
+            fragment_debuginfo = tb.tb_frame.f_globals['_spy_debuginfo']
+            frame_kind = 'synthetic_callable'
         elif fragment_debuginfo and isinstance(tb.tb_frame.f_globals, Context):
             if delete_in is not None:  # pragma: no branch
                 del entries[delete_in:]
@@ -153,7 +185,7 @@ class handler:
         _install_excepthook()
 
     def __exit__(self, typ, exc, traceback):
-        if exc is None:
+        if exc is None or isinstance(exc, CaughtException):
             return
         formatted = _format_exc(typ, exc, traceback, **self.kw)
         raise CaughtException(formatted) from exc
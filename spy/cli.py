@@ -1,20 +1,27 @@
+import ast
 import builtins
+import codecs
+import dis
+import inspect
+import io
 import platform
+import re
 import sys
+import threading
 from contextlib import ExitStack
 from functools import partial
 from importlib import import_module
 from itertools import chain
 from pkgutil import iter_modules
+from types import CodeType
 
 from clize import Clize, run
 from clize.errors import ArgumentError, MissingValue, UnknownOption, SetArgumentErrorContext
-from clize.parameters import multi
+from clize.parameters import multi, one_of
 from clize.parser import use_mixin, Parameter, NamedParameter
 
-from . import catcher, fragments, prelude
-from .decorators import decorators
-from .objects import Context, _ContextInjector, SpyFile
+from . import catcher, codegen, core, decorators, formats, fragments, parallel, prelude, profiling, readers, stats
+from .objects import Context, _ContextInjector, MappedSpyFile, SpyFile, _wrap
 
 import spy
 import spy_plugins
@@ -74,40 +81,115 @@ def pretty_syntax_error(source, err):
 
 
 def make_callable(code, is_expr, env, pipe_name, debuginfo=(None, None)):
-    local = orig_local = env.view()
-    local._spy_debuginfo = debuginfo
-    overlay = local.overlay
-    proxy = overlay['spy'] = _ContextInjector(spy)
+    keywords = False
+    kwenv = threading.local()
+
+    def make_local(value, context):
+        if keywords:
+            return kwenv.local
+        local = env.view()
+        local._spy_debuginfo = debuginfo
+        overlay = local.overlay
+        overlay[pipe_name] = value
+        overlay['spy'] = _ContextInjector(spy, context)
+        return local
     if is_expr:
         def fragment_fn(value, context=None):
-            overlay[pipe_name] = value
-            proxy._ContextInjector__context = context
-            return eval(code, env, local)
+            return eval(code, env, make_local(value, context))
     else:
         def fragment_fn(value, context=None):
-            overlay[pipe_name] = value
-            proxy._ContextInjector__context = context
+            local = make_local(value, context)
             eval(code, env, local)
-            return orig_local[pipe_name]
+            if keywords:
+                return _wrap(value)
+            return local[pipe_name]
     def setenv(m):
-        nonlocal env, local
-        local = m
+        nonlocal keywords
+        keywords = True
+        kwenv.local = m
     fragment_fn._spy_debuginfo = debuginfo
     fragment_fn._spy_setenv = setenv
     return fragment_fn
 
 
 def make_literal(code, env, pipe_name, debuginfo):
-    local = env.view()
-    local._spy_debuginfo = debuginfo
+    keywords = False
+    kwenv = threading.local()
+
     def fragment_fn(value):
-        local[pipe_name] = value
+        if keywords:
+            local = kwenv.local
+            local[pipe_name] = value
+        else:
+            local = env.view()
+            local._spy_debuginfo = debuginfo
+            local.overlay[pipe_name] = value
         return (local, code)
     def setenv(m):
-        nonlocal env, local
-        local = m
+        nonlocal keywords
+        keywords = True
+        kwenv.local = m
     fragment_fn._spy_debuginfo = debuginfo
     fragment_fn._spy_setenv = setenv
+    fragment_fn._spy_literal = code
+    fragment_fn._spy_pipe_name = pipe_name
+    return fragment_fn
+
+
+_NAMESPACE_FUNCTIONS = frozenset(['dir', 'eval', 'exec', 'locals', 'vars'])
+
+
+def make_function(source, is_expr, env, pipe_name, debuginfo=(None, None),
+                  local_names=()):
+    """Compile ``source`` into a function taking the pipe value as a fast
+    local, rather than evaluating it in a namespace view per item.
+
+    The names the code loads are resolved in ``env`` once, up front, so this
+    is only correct if nothing changes them while the chain runs. Names in
+    ``local_names`` are assigned by the code and become function locals.
+    Returns None if the code can't be compiled as a function body.
+    """
+    filename = debuginfo[0] or '<input>'
+    tree = ast.parse(source, filename, 'eval' if is_expr else 'exec')
+    if is_expr:
+        body = [ast.Return(tree.body, lineno=1, col_offset=0)]
+    else:
+        body = tree.body + [ast.Return(ast.Name(pipe_name, ast.Load()))]
+    args = ast.arguments(posonlyargs=[], args=[ast.arg(pipe_name), ast.arg('spy')],
+                         vararg=None, kwonlyargs=[], kw_defaults=[], kwarg=None,
+                         defaults=[ast.Constant(None)])
+    func = ast.FunctionDef(name='<fragment>', args=args, body=body,
+                           decorator_list=[], returns=None, type_params=[],
+                           lineno=1, col_offset=0)
+    module = ast.fix_missing_locations(ast.Module([func], type_ignores=[]))
+    try:
+        co = compile(module, filename, 'exec', 0, True, 0)
+    except SyntaxError:
+        return None
+    loads, _ = _name_usage(co)
+    g = {}
+    for name in loads - set(local_names) - {pipe_name, 'spy'}:
+        try:
+            g[name] = _wrap(env[name])
+        except KeyError:
+            pass
+    g['_spy_debuginfo'] = debuginfo
+    exec(co, g)
+    fn = g.pop('<fragment>')
+    uses_spy = any(isinstance(node, ast.Name) and node.id == 'spy'
+                   for node in ast.walk(tree))
+
+    if is_expr:
+        def fragment_fn(value, context=None):
+            if uses_spy:
+                return fn(_wrap(value), _ContextInjector(spy, context))
+            return fn(_wrap(value))
+    else:
+        def fragment_fn(value, context=None):
+            if uses_spy:
+                return _wrap(fn(_wrap(value), _ContextInjector(spy, context)))
+            return _wrap(fn(_wrap(value)))
+    fragment_fn._spy_debuginfo = debuginfo
     return fragment_fn
 
 
@@ -317,12 +399,249 @@ class LiteralDecorator(Decorator):
         raise MissingValue
 
 
+def _code_names(co):
+    names = set(co.co_names)
+    for const in co.co_consts:
+        if isinstance(const, CodeType):
+            names |= _code_names(const)
+    return names
+
+
+def _name_usage(co):
+    """Return the sets of global (or module-level) names loaded and stored by
+    ``co`` and any code nested in it."""
+    loads = set()
+    stores = set()
+    for instr in dis.get_instructions(co):
+        if instr.opname in ('LOAD_NAME', 'LOAD_GLOBAL'):
+            loads.add(instr.argval)
+        elif instr.opname in ('STORE_NAME', 'STORE_GLOBAL', 'DELETE_NAME', 'DELETE_GLOBAL'):
+            stores.add(instr.argval)
+    for const in co.co_consts:
+        if isinstance(const, CodeType):
+            l, s = _name_usage(const)
+            loads |= l
+            stores |= s
+    return loads, stores
+
+
+_JUMPS = frozenset(dis.hasjrel) | frozenset(dis.hasjabs)
+
+
+def _stored_before_loaded(co, names):
+    """Return whether straight-line code ``co`` certainly stores each of
+    ``names`` before loading it, so it never sees a value from another run."""
+    if not names:
+        return True
+    if getattr(co, 'co_exceptiontable', b''):
+        return False
+    stored = set()
+    for instr in dis.get_instructions(co):
+        if instr.opcode in _JUMPS:
+            return False
+        if instr.argval not in names:
+            continue
+        if instr.opname in ('STORE_NAME', 'STORE_GLOBAL'):
+            stored.add(instr.argval)
+        elif instr.opname in ('LOAD_NAME', 'LOAD_GLOBAL') and instr.argval not in stored:
+            return False
+        elif instr.opname in ('DELETE_NAME', 'DELETE_GLOBAL'):
+            return False
+    return not any(isinstance(const, CodeType) and _name_usage(const)[0] & names
+                   for const in co.co_consts)
+
+
+def _global_stores(co):
+    stores = set()
+    for instr in dis.get_instructions(co):
+        if instr.opname in ('STORE_GLOBAL', 'DELETE_GLOBAL'):
+            stores.add(instr.argval)
+    for const in co.co_consts:
+        if isinstance(const, CodeType):
+            stores |= _global_stores(const)
+    return stores
+
+
+def _needs_stream(code, funcseq):
+    if decorators.accumulate in funcseq:
+        return True
+    return code is not None and 'collect' in _code_names(code)
+
+
+def _awaits(parsed_step, context):
+    # whether the fragment calls a coroutine function the prelude defined or
+    # imported (without importing anything just to find out)
+    return any(inspect.iscoroutinefunction(context.get(name)) for name in parsed_step.loads)
+
+
+def _run_prelude(context, prelude):
+    for stmt in prelude:
+        exec(stmt, context, context.view())
+
+
+class _ParsedStep:
+    __slots__ = ('code', 'co', 'is_expr', 'funcseq', 'debuginfo', 'loads',
+                 'local_names')
+
+    def __init__(self, code, co, is_expr, funcseq, debuginfo):
+        self.code = code
+        self.co = co
+        self.is_expr = is_expr
+        self.funcseq = funcseq
+        self.debuginfo = debuginfo
+        self.loads = set()
+        # set by _plan_steps: names to keep local if this step can be
+        # compiled with make_function, otherwise None
+        self.local_names = None
+
+
+def _field_hint(parsed, pipe_name):
+    """Find the furthest field of the pipe any fragment picks out with a
+    constant, like ``pipe[3]`` or ``itemgetter(3)``, so that records can be
+    split as far as that in one go."""
+    hint = 0
+    for p in parsed:
+        if p.co is None:
+            continue
+        for node in ast.walk(ast.parse(p.code)):
+            if (isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name)
+                    and node.value.id == pipe_name):
+                indices = [getattr(node.slice, 'value', node.slice)]
+            elif (isinstance(node, ast.Call) and
+                    getattr(node.func, 'id', getattr(node.func, 'attr', None)) == 'itemgetter'):
+                indices = node.args
+            else:
+                continue
+            for index in indices:
+                if (isinstance(index, ast.Constant) and type(index.value) is int
+                        and index.value >= 0):
+                    hint = max(hint, index.value)
+    return hint
+
+
+def parse_steps(step_src, break_=False):
+    parsed = []
+    for i, code in enumerate(step_src):
+        fragment_name = 'Fragment {}'.format(i + 1)
+        source = code
+        literal = False
+        if isinstance(code, _Decorated):
+            source = '{} {!r}'.format(code.name, code.value)
+            literal = code.LITERAL
+            code, funcseq = code.value, code.funcseq
+        else:
+            funcseq = ()
+        co = is_expr = None
+        if not literal:
+            try:
+                co, is_expr = compile_(code, filename=fragment_name)
+            except SyntaxError as e:
+                pretty_syntax_error(code, e)
+                if break_:  # pragma: no cover
+                    debugger()
+                sys.exit(1)
+        parsed.append(_ParsedStep(code, co, is_expr, funcseq, (fragment_name, source)))
+    return parsed
+
+
+def _plan_steps(parsed, context, pipe_name, prelude):
+    usage = [_name_usage(p.co) if p.co is not None else (set(), set())
+             for p in parsed]
+    mutable = set()
+    for stmt in prelude:
+        try:
+            mutable |= _global_stores(compile(stmt, '<prelude>', 'exec'))
+        except SyntaxError:
+            pass
+    for i, p in enumerate(parsed):
+        if p.co is None:
+            continue
+        loads, stores = usage[i]
+        p.loads = loads
+        other_loads = set()
+        other_stores = set(mutable)
+        for j, (l, s) in enumerate(usage):
+            if j != i:
+                other_loads |= l
+                other_stores |= s
+        local_names = stores - {pipe_name}
+        if (decorators.keywords not in p.funcseq
+                and not loads & _NAMESPACE_FUNCTIONS
+                and not loads & other_stores
+                and not local_names & (other_loads | other_stores | set(context))
+                and _stored_before_loaded(p.co, local_names & loads)):
+            p.local_names = local_names
+
+
+def make_steps(step_src, context, pipe_name, break_=False, threads=0,
+               concurrency=0, ordered=True, prelude=(), parsed=None):
+    """Compile command-line steps into a list of ``(fragment, needs_stream)``
+    pairs.
+
+    ``needs_stream`` is true for fragments that consume more than the item
+    they're given, i.e. ones using ``--accumulate`` or ``spy.collect``. If
+    ``concurrency`` is given, other fragments await their results with that
+    many in flight at once; otherwise if ``threads`` is given, they evaluate
+    that many items at once. Without ``concurrency``, fragments calling a
+    coroutine function from ``context`` await their results one at a time.
+
+    Fragments are compiled with :func:`make_function` where that doesn't
+    change their meaning: they must not use ``--keywords``, assign names
+    other fragments can see, or read names something else assigns while
+    the chain runs (including functions defined in the ``prelude``).
+    """
+    if parsed is None:
+        parsed = parse_steps(step_src, break_)
+        _plan_steps(parsed, context, pipe_name, prelude)
+    steps = []
+    for p in parsed:
+        ca = None
+        if p.co is None:
+            ca = make_literal(p.code, context, pipe_name, p.debuginfo)
+        elif p.local_names is not None:
+            ca = make_function(p.code, p.is_expr, context, pipe_name, p.debuginfo,
+                               p.local_names)
+        if ca is None:
+            ca = make_callable(p.co, p.is_expr, context, pipe_name, p.debuginfo)
+        for fn in p.funcseq:
+            ca = fn(ca)
+        needs_stream = _needs_stream(p.co, p.funcseq)
+        if (concurrency or _awaits(p, context)) and not needs_stream:
+            steps.append((core.async_fragment(ca, concurrency or 1, ordered), False))
+        elif threads and not needs_stream:
+            steps.append((core.threaded_fragment(ca, threads), False))
+        else:
+            steps.append((spy.fragment(ca), needs_stream))
+    return steps
+
+
 def _main(*steps: (use_mixin(StepList), Parameter.REQUIRED),
           each_line: 'l' = False,  # noqa: F821
           raw: 'r' = False,  # noqa: F821
+          binary: bool = False,
+          forward_only: bool = False,
+          input_: one_of(*formats.DECODERS) = None,
+          fields: str = None,
+          decompress: one_of('auto', 'thread', 'off') = 'auto',  # noqa: F821
+          file: multi() = None,
+          combine: one_of(*readers.Inputs.modes) = 'concat',
+          merge_key: str = None,
+          follow: str = None,
+          read_ahead: int = 0,
+          output: one_of(*formats.ENCODERS) = None,
+          output_buffer: int = 1 << 16,
+          line_buffered: bool = False,
           start: (int, 's') = 0,  # noqa: F821
           end: (int, 'e') = None,  # noqa: F821
           prelude: (multi(), 'p') = 'pass',  # noqa: F821
+          processes: int = 0,
+          threads: int = 0,
+          concurrency: int = 0,
+          unordered: bool = False,
+          engine: one_of('auto', 'chain', 'codegen') = 'auto',  # noqa: F821
+          profile: bool = False,
+          cprofile: str = None,
+          flamegraph: str = None,
           pipe_name: Parameter.UNDOCUMENTED = PIPE_NAME,
           no_default_fragments: Parameter.UNDOCUMENTED = False,
           no_exception_handling: Parameter.UNDOCUMENTED = False,
@@ -336,73 +655,360 @@ def _main(*steps: (use_mixin(StepList), Parameter.REQUIRED),
     :param end: Stop after getting this result (zero-based)
     :param prelude: Execute a statement before running any steps. Can be specified more than once.
     :param raw: Don't add helper functionality to stdin
+    :param binary: Read stdin as bytes and write bytes results to stdout unchanged
+    :param forward_only: Release lines of stdin once they've been iterated over
+    :param input_: Decode stdin in this format and process each record, like --each-line
+    :param fields: Split each line on this separator (or whitespace if it's empty) into a tuple-like record, as it's needed
+    :param decompress: Decompress gzip, bzip2 or xz input: 'auto' when it's detected; 'thread' likewise, in a background thread; 'off' never
+    :param file: Read this file instead of stdin ('-' for stdin). Can be specified more than once.
+    :param combine: How to combine several files: 'concat' reads them in turn; 'interleave' takes a line from each in turn; 'merge-sorted' merges sorted files into sorted output
+    :param merge_key: With --combine=merge-sorted, the expression of the pipe the files are sorted by
+    :param follow: Process lines as they're appended to this file, following it when it's rotated or truncated
+    :param read_ahead: Read stdin in a background thread, up to this many blocks ahead
+    :param output: Write results in this format instead of printing them
+    :param output_buffer: Write results to stdout in blocks of about this many characters
+    :param line_buffered: Flush stdout after each result (the default if it's a terminal)
+    :param processes: Run fragments over lines in this many worker processes
+    :param threads: Evaluate each fragment over this many items at once in threads
+    :param concurrency: Await fragment results, with up to this many in flight at once
+    :param unordered: With --concurrency, emit results as soon as they're ready
+    :param profile: Print statistics for each fragment to stderr when finished
+    :param cprofile: Profile with cProfile and save the statistics to this file
+    :param flamegraph: Sample the stack while running and save it to this file in collapsed stack format
+    :param engine: How to run the fragments: 'chain' runs each as its own step; 'codegen' generates one function for the whole chain; 'auto' uses 'codegen' when possible
     """
     pipe_name = sys.intern(pipe_name)
 
     spy.context = context = make_context()
-
-    for stmt in prelude:
-        exec(stmt, context, context.view())
+    _run_prelude(context, prelude)
 
     step_src = steps
-    steps = []
-    for i, code in enumerate(step_src):
-        fragment_name = 'Fragment {}'.format(i + 1)
-        source = code
-        literal = False
-        if isinstance(code, _Decorated):
-            source = '{} {!r}'.format(code.name, code.value)
-            literal = code.LITERAL
-            code, funcseq = code.value, code.funcseq
-        else:
-            funcseq = ()
-        debuginfo = (fragment_name, source)
-        if literal:
-            ca = make_literal(code, context, pipe_name, debuginfo)
-        else:
-            try:
-                co, is_expr = compile_(code, filename=fragment_name)
-            except SyntaxError as e:
-                pretty_syntax_error(code, e)
-                if break_:  # pragma: no cover
-                    debugger()
-                sys.exit(1)
-            ca = make_callable(co, is_expr, context, pipe_name, debuginfo)
-        for fn in funcseq:
-            ca = fn(ca)
-        steps.append(spy.fragment(ca))
+    step_kw = dict(threads=threads, concurrency=concurrency, ordered=not unordered)
+    parsed = parse_steps(step_src, break_)
+    _plan_steps(parsed, context, pipe_name, prelude)
+    compiled = make_steps(step_src, context, pipe_name, parsed=parsed, **step_kw)
+    steps = [step for step, _ in compiled]
 
     index_offset = 0
+    writer = None
+    each_line = each_line or input_ is not None or follow is not None
+    fields_step = None
+    if fields is not None and not input_:
+        sep = codecs.decode(fields, 'unicode_escape') or None
+        if binary and sep is not None:
+            sep = sep.encode(sys.stdin.encoding or 'utf-8')
+        fields_step = fragments.make_fields(sep, _field_hint(parsed, pipe_name))
+        each_line = True
 
     if not no_default_fragments:
+        encoder, binary_output = formats.make_encoder(output) if output else (None, False)
+        writer = fragments.Writer(buffer_size=output_buffer, binary=binary or binary_output,
+                                  line_buffered=line_buffered or None, encoder=encoder)
         steps.append(fragments.make_limit(start=start, end=end))
-        steps.append(fragments.print)
+        steps.append(fragments.make_print(writer))
 
+        if fields_step is not None:
+            steps.insert(0, fields_step)
+            index_offset -= 1
         if each_line:
             steps.insert(0, fragments.foreach)
             index_offset -= 1
 
     chain = spy.chain(steps, index_offset=index_offset)
-    if raw:
-        data = [sys.stdin]
+    reader = None
+    stdin = sys.stdin
+    if not (file or follow or raw or show_fragments):
+        stdin = _open_decompressed(stdin, decompress)
+    scan = None
+    if each_line and not (input_ or fields_step or raw or file or follow or read_ahead
+                          or processes or no_default_fragments):
+        scan = _scanner(parsed, pipe_name, binary, stdin)
+    if scan is not None:
+        # the reader does the first fragment's work
+        first = -chain.index_offset
+        chain.seq[first] = _prematched(chain.seq[first])
+    if follow is not None:
+        idle = writer and writer.flush
+        encoding = getattr(sys.stdin, 'encoding', None)
+        errors = getattr(sys.stdin, 'errors', None)
+        if read_ahead:
+            _warn('--read-ahead only applies to stdin')
+        if input_:
+            batches = readers.follow(follow, input_ == 'jsonl', encoding, errors, idle)
+            batches = formats.decode(input_, batches)
+            data = [(record for batch in batches for record in batch)]
+        elif binary:
+            batches = readers.follow(follow, True, idle=idle)
+            data = [(line for batch in batches for line in batch)]
+        else:
+            batches = readers.follow(follow, False, encoding, errors, idle)
+            data = [(line.rstrip('\n') for batch in batches for line in batch)]
+    elif file:
+        key = None
+        if merge_key is not None:
+            key = _make_key(merge_key, context, pipe_name, break_)
+        opener = partial(_open_file, binary=binary, input_=input_, decompress=decompress)
+        spy.inputs = inputs = readers.Inputs(file, opener, combine, key)
+        if read_ahead:
+            _warn('--read-ahead only applies to stdin')
+        if input_ or each_line or raw:
+            data = [inputs]
+        elif binary:
+            data = [memoryview(b''.join(line + b'\n' for line in inputs))]
+        else:
+            data = [SpyFile(inputs, forward_only)]
+    elif scan is not None:
+        data = [scan(stdin.buffer if binary else stdin)]
+    elif input_:
+        batches = _decode_batches(stdin, input_)
+        if read_ahead:
+            reader = readers.ReadAhead(batches, read_ahead)
+            data = [reader]
+        else:
+            data = [(record for batch in batches for record in batch)]
+    elif binary:
+        if raw:
+            data = [stdin.buffer]
+        elif each_line and read_ahead:
+            reader = readers.ReadAhead(readers.read_line_batches(stdin.buffer), read_ahead)
+            data = [reader]
+        elif each_line:
+            data = [readers.read_lines(stdin.buffer)]
+        else:
+            data = [readers.read_buffer(stdin.buffer)]
+    elif raw:
+        data = [stdin]
+    elif read_ahead:
+        reader = readers.ReadAhead(readers.read_text_batches(stdin), read_ahead,
+                                   name=getattr(stdin, 'name', None))
+        data = [SpyFile(reader, forward_only)]
     else:
-        data = [SpyFile(sys.stdin)]
+        data = [_open_input(stdin, forward_only)]
+
+    pipeline = None
+    if engine != 'chain':
+        pipeline = _make_pipeline(parsed[1:] if scan is not None else parsed, context, pipe_name, start, end,
+                                  no_default_fragments or threads or concurrency or processes
+                                  or profile or cprofile or any(_awaits(p, context) for p in parsed),
+                                  writer and writer.write)
+        if pipeline is None and engine == 'codegen':
+            _warn("can't generate code for these fragments; running them as a chain")
 
     if show_fragments:
         print(chain.format())
+        if pipeline is not None:
+            print()
+            print(pipeline[1], end='')
         return
 
+    if pipeline is not None:
+        if each_line:
+            data = fragments.foreach(data)
+        if fields_step is not None:
+            data = fields_step(data)
+        run = partial(pipeline[0], data)
+    else:
+        if processes > 0:
+            chain = _parallel_chain(chain, compiled, step_src, prelude, pipe_name,
+                                    processes=processes, step_kw=step_kw,
+                                    each_line=each_line and not no_default_fragments,
+                                    handle_exceptions=not no_exception_handling)
+        if profile:
+            profiler = stats.Profiler()
+            if reader is not None:
+                profiler.add_source('read-ahead', reader)
+            chain = profiler.wrap(chain)
+        run = partial(chain.run_to_exhaustion, data)
+
     with ExitStack() as stack:
+        if profile:
+            stack.callback(profiler.report)
+        if cprofile or flamegraph:
+            labels = profiling.fragment_labels(p.debuginfo for p in parsed)
+            if cprofile:
+                stack.enter_context(profiling.cprofile(cprofile, labels))
+            if flamegraph:
+                stack.enter_context(profiling.flamegraph(flamegraph, labels))
         if not no_exception_handling:
             stack.enter_context(catcher.handler(delete_all=True))
         if break_:  # pragma: no cover
             stack.enter_context(DebuggerContext())
-        chain.run_to_exhaustion(data)
+        if writer is not None:
+            # before an exception is reported
+            stack.callback(writer.flush)
+        run()
+
+
+def _make_pipeline(parsed, context, pipe_name, start, end, unsupported, output):
+    if unsupported:
+        return None
+    steps = []
+    for p in parsed:
+        if p.co is None or not p.is_expr or p.local_names != set():
+            return None
+        steps.append((p.code, p.funcseq, p.debuginfo, p.loads))
+    return codegen.make_pipeline(steps, context, pipe_name, start=start, end=end,
+                                 output=output)
+
+
+def _scanner(parsed, pipe_name, binary, stdin):
+    """If the reader can do the first fragment's work by searching blocks
+    of ``stdin``, return a function making that reader from the stream.
+
+    That's a ``--regex`` (perhaps with ``--filter``), or a ``--filter``
+    testing for a constant substring with ``'...' in pipe``."""
+    if not parsed:
+        return None
+    first = parsed[0]
+    funcseq = list(first.funcseq)
+    if first.co is None and funcseq in ([decorators.regex], [decorators.regex, decorators.filter]):
+        pattern = _scan_pattern(first.code, binary, stdin)
+        if pattern is not None:
+            return partial(readers.match_lines, pattern=pattern, filter=len(funcseq) > 1)
+    elif first.co is not None and funcseq == [decorators.filter]:
+        needle = _needle(first.code, pipe_name, bytes if binary else str)
+        if needle is not None:
+            return partial(readers.find_lines, needle=needle)
+    return None
+
+
+def _needle(source, pipe_name, type_):
+    try:
+        tree = ast.parse(source.strip(), mode='eval').body
+    except SyntaxError:
+        return None
+    if (isinstance(tree, ast.Compare) and isinstance(tree.left, ast.Constant)
+            and type(tree.left.value) is type_ and len(tree.ops) == 1
+            and isinstance(tree.ops[0], ast.In)
+            and isinstance(tree.comparators[0], ast.Name)
+            and tree.comparators[0].id == pipe_name):
+        needle = tree.left.value
+        if (b'\n' if type_ is bytes else '\n') not in needle:
+            return needle
+    return None
+
+
+def _scan_pattern(source, binary, stdin):
+    if binary:
+        source = source.encode(getattr(stdin, 'encoding', None) or 'utf-8')
+    try:
+        pattern = re.compile(source)
+    except re.error:
+        return None
+    return pattern if readers.scannable(pattern) else None
+
+
+def _prematched(step):
+    def prematched(ita, index=None):
+        return ita
+    prematched.fragment_fn = step.fragment_fn
+    return prematched
+
+
+def _make_key(source, context, pipe_name, break_=False):
+    debuginfo = ('Merge key', source)
+    try:
+        co, is_expr = compile_(source, filename=debuginfo[0])
+    except SyntaxError as e:
+        pretty_syntax_error(source, e)
+        if break_:  # pragma: no cover
+            debugger()
+        sys.exit(1)
+    return make_callable(co, is_expr, context, pipe_name, debuginfo)
+
+
+def _decode_batches(stream, input_):
+    if input_ == 'jsonl' and hasattr(stream, 'buffer'):
+        # JSON is UTF-8 anyway, so let the decoder take bytes
+        batches = readers.read_line_batches(stream.buffer)
+    else:
+        batches = readers.read_text_batches(stream)
+    return formats.decode(input_, batches)
+
+
+def _open_file(name, *, binary, input_, decompress):
+    if name == '-':
+        stream = _open_decompressed(sys.stdin, decompress)
+    else:
+        buffer = open(name, 'rb')
+        if decompress != 'off':
+            buffer = readers.open_decompressed(buffer, decompress == 'thread') or buffer
+        stream = io.TextIOWrapper(buffer, encoding=sys.stdin.encoding, errors=sys.stdin.errors)
+    if input_:
+        items = (record for batch in _decode_batches(stream, input_) for record in batch)
+    elif binary:
+        items = readers.read_lines(stream.buffer)
+    else:
+        items = _open_input(stream)._line_iter()
+    # being a generator keeps the stream open while its items are needed
+    try:
+        yield from items
+    finally:
+        if name != '-':
+            stream.close()
+
+
+def _open_decompressed(stream, mode):
+    buffer = getattr(stream, 'buffer', None)
+    if mode == 'off' or buffer is None or stream.isatty():
+        return stream
+    decompressed = readers.open_decompressed(buffer, threaded=mode == 'thread')
+    if decompressed is None:
+        return stream
+    return io.TextIOWrapper(decompressed, encoding=stream.encoding, errors=stream.errors)
+
+
+def _open_input(stream, forward_only=False):
+    if forward_only:
+        return SpyFile(stream, forward_only=True)
+    try:
+        return MappedSpyFile(stream)
+    except (OSError, ValueError):
+        return SpyFile(stream)
+
+
+def _warn(msg):
+    print('spy: warning: ' + msg, file=sys.stderr)
+
+
+def _parallel_chain(chain, compiled, step_src, prelude, pipe_name, *,
+                    processes, step_kw, each_line, handle_exceptions):
+    if not each_line:
+        _warn('--processes needs --each-line; running in a single process')
+        return chain
+    if not parallel._have_fork():  # pragma: no cover
+        _warn("--processes isn't supported on this platform; running in a single process")
+        return chain
+    n = 0
+    while n < len(compiled) and not compiled[n][1]:
+        n += 1
+    if n < len(compiled):
+        _warn('fragment {} needs the whole stream; it and any later fragments '
+              'will run in the main process'.format(n + 1))
+    if n == 0:
+        return chain
+
+    def make_worker_steps():
+        spy.context = context = make_context()
+        _run_prelude(context, prelude)
+        return [step for step, _ in make_steps(step_src[:n], context, pipe_name,
+                                               prelude=prelude, **step_kw)]
+
+    def run_parallel(ita):
+        return parallel.process_map(make_worker_steps, ita,
+                                    processes=processes,
+                                    handle_exceptions=handle_exceptions)
+
+    # chain.seq is [foreach, (fields,) *fragments, limit, print]
+    seq = list(chain.seq)
+    first = -chain.index_offset
+    seq[first:first + n] = [run_parallel]
+    return spy.chain(seq, index_offset=chain.index_offset)
 
 
 def _prepare_decorators():
     rv = []
-    for fn in sorted(decorators, key=lambda fn: fn.decorator_names):
+    for fn in sorted(decorators.decorators, key=lambda fn: fn.decorator_names):
         if fn.takes_string:
             cls = LiteralDecorator
         else:
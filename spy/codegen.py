@@ -0,0 +1,141 @@
+import builtins
+from types import ModuleType
+
+from . import decorators, fragments, prelude
+from .objects import _ModuleProxy, _wrap
+
+
+_DECORATOR_CODES = {
+    decorators.callable: 'c',
+    decorators.filter: 'f',
+    decorators.many: 'm',
+    decorators.try_except: 't',
+}
+
+# What may follow any number of --callables, innermost first. Other orders
+# (like --filter --try, which lets errors through as true) aren't worth
+# reproducing.
+_SHAPES = frozenset(['', 't', 'f', 'm', 'ft', 'mt'])
+
+_missing = object()
+
+
+def _shape(funcseq):
+    codes = ''.join(_DECORATOR_CODES.get(fn, '?') for fn in funcseq)
+    rest = codes.lstrip('c')
+    if rest not in _SHAPES:
+        return None
+    return len(codes) - len(rest), rest
+
+
+def _is_spy(module):
+    return module.__name__.partition('.')[0] == 'spy'
+
+
+def _safe_value(name, value):
+    """Return whether ``value`` can't produce spy.DROP or spy.many, which the
+    generated code doesn't check for."""
+    if name in prelude.__all__ and getattr(prelude, name, _missing) is value:
+        return True
+    if builtins.__dict__.get(name, _missing) is value:
+        return True
+    if isinstance(value, _ModuleProxy):
+        return not _is_spy(value._ModuleProxy__module)
+    if isinstance(value, ModuleType):
+        return not _is_spy(value)
+    return not callable(value)
+
+
+class _Writer:
+    def __init__(self):
+        self.lines = []
+        self.linemap = {}
+
+    def emit(self, indent, text, info=None):
+        for line in text.split('\n'):
+            self.lines.append(' ' * indent + line)
+            if info is not None:
+                self.linemap[len(self.lines)] = info
+
+    def source(self):
+        return '\n'.join(self.lines) + '\n'
+
+
+def make_pipeline(steps, env, pipe_name, *, start=0, end=None,
+                  output=fragments.pretty_print):
+    """Generate one function running ``steps`` and printing the results, as
+    the default chain would.
+
+    ``steps`` is a sequence of ``(source, funcseq, debuginfo, loads)``
+    tuples, where each source is an expression that doesn't assign any
+    names and ``loads`` is the set of global names it reads. Returns a
+    ``(function, source)`` pair, or None if the steps can't be run this way.
+    The function takes an iterable of input values and calls ``output`` on
+    each result.
+    """
+    if end is not None and end <= start:
+        return None
+    g = {}
+    for source, funcseq, debuginfo, loads in steps:
+        if _shape(funcseq) is None or 'spy' in loads:
+            return None
+        for name in loads - {pipe_name}:
+            try:
+                value = env[name]
+            except KeyError:
+                continue
+            if not _safe_value(name, value):
+                return None
+            g[name] = _wrap(value)
+
+    w = _Writer()
+    w.emit(0, 'def _spy_pipeline(_spy_ita):')
+    if start or end is not None:
+        w.emit(4, '_spy_n = 0')
+    w.emit(4, 'for {} in _spy_ita:'.format(pipe_name))
+    indent = 8
+    for source, funcseq, debuginfo, loads in steps:
+        calls, shape = _shape(funcseq)
+        fragment = (debuginfo, None)
+        body = indent
+        if 't' in shape:
+            w.emit(indent, 'try:', (debuginfo, decorators.try_except))
+            body += 4
+        w.emit(body, '_spy_r = (', fragment)
+        w.emit(0, source, fragment)
+        w.emit(body, ')', fragment)
+        for _ in range(calls):
+            w.emit(body, '_spy_r = _spy_r({})'.format(pipe_name),
+                   (debuginfo, decorators.callable))
+        if shape == 'ft':
+            w.emit(body, 'if not _spy_r:', (debuginfo, decorators.filter))
+            w.emit(body + 4, 'continue')
+        if 't' in shape:
+            w.emit(indent, 'except BaseException:', (debuginfo, decorators.try_except))
+            w.emit(indent + 4, 'continue')
+        if shape == 'f':
+            w.emit(indent, 'if not _spy_r:', (debuginfo, decorators.filter))
+            w.emit(indent + 4, 'continue')
+        elif shape in ('m', 'mt'):
+            w.emit(indent, 'for {} in _spy_r:'.format(pipe_name),
+                   (debuginfo, decorators.many))
+            indent += 4
+        elif shape in ('', 't'):
+            w.emit(indent, '{} = _spy_r'.format(pipe_name))
+    if start:
+        w.emit(indent, 'if _spy_n >= {!r}:'.format(start))
+        w.emit(indent + 4, '_spy_print({})'.format(pipe_name))
+    else:
+        w.emit(indent, '_spy_print({})'.format(pipe_name))
+    if start or end is not None:
+        w.emit(indent, '_spy_n += 1')
+    if end is not None:
+        w.emit(indent, 'if _spy_n >= {!r}:'.format(end))
+        w.emit(indent + 4, 'return')
+
+    source = w.source()
+    g['_spy_print'] = output
+    g['_spy_linemap'] = w.linemap
+    g['_spy_pipe_name'] = pipe_name
+    exec(compile(source, '<spy pipeline>', 'exec', 0, True, 0), g)
+    return g.pop('_spy_pipeline'), source
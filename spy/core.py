@@ -1,3 +1,6 @@
+from collections import deque
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import numbers
 import inspect
 import itertools
@@ -56,6 +59,93 @@ def fragment(fn):
     return fragment
 
 
+def threaded_fragment(fn, threads):
+    with_context = _accepts_context(fn)
+
+    def call(value):
+        if with_context:
+            return fn(value, _Context(value, iter(())))
+        return fn(value)
+
+    def fragment(ita, index=None):
+        ita = iter(ita)
+        _spy_fragment_index = index  # noqa: F841
+        pending = deque()
+        with ThreadPoolExecutor(threads) as pool:
+            try:
+                while True:
+                    for value in itertools.islice(ita, threads * 2 - len(pending)):
+                        pending.append((value, pool.submit(call, value)))
+                    if not pending:
+                        break
+                    _spy_value, future = pending.popleft()
+                    result = future.result()
+                    if result is DROP:
+                        continue
+                    elif isinstance(result, many):
+                        yield from result.ita
+                    else:
+                        yield result
+            finally:
+                for _, future in pending:
+                    future.cancel()
+    fragment.fragment_fn = fn
+    return fragment
+
+
+def async_fragment(fn, concurrency=16, ordered=True):
+    with_context = _accepts_context(fn)
+
+    async def call(value):
+        if with_context:
+            result = fn(value, _Context(value, iter(())))
+        else:
+            result = fn(value)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    def fragment(ita, index=None):
+        ita = iter(ita)
+        _spy_fragment_index = index  # noqa: F841
+        loop = asyncio.new_event_loop()
+        pending = []
+        try:
+            while True:
+                for value in itertools.islice(ita, concurrency - len(pending)):
+                    pending.append((value, loop.create_task(call(value))))
+                if not pending:
+                    break
+                if ordered:
+                    loop.run_until_complete(asyncio.wait([pending[0][1]]))
+                    n = 0
+                    while n < len(pending) and pending[n][1].done():
+                        n += 1
+                    done, pending = pending[:n], pending[n:]
+                else:
+                    loop.run_until_complete(asyncio.wait(
+                        [task for _, task in pending],
+                        return_when=asyncio.FIRST_COMPLETED))
+                    done = [p for p in pending if p[1].done()]
+                    pending = [p for p in pending if not p[1].done()]
+                for _spy_value, task in done:
+                    result = task.result()
+                    if result is DROP:
+                        continue
+                    elif isinstance(result, many):
+                        yield from result.ita
+                    else:
+                        yield result
+        finally:
+            for _, task in pending:
+                task.cancel()
+            if pending:
+                loop.run_until_complete(asyncio.wait([task for _, task in pending]))
+            loop.close()
+    fragment.fragment_fn = fn
+    return fragment
+
+
 step = fragment
 
 
@@ -67,10 +157,14 @@ class chain:
         self.index_offset = index_offset
 
     @classmethod
-    def auto_fragments(cls, seq, **kw):
+    def auto_fragments(cls, seq, threads=None, concurrency=16, ordered=True, **kw):
         def make_fragment(f):
             if hasattr(f, '__code__') and f.__code__.co_flags & 0x20:
                 return f
+            elif inspect.iscoroutinefunction(f):
+                return async_fragment(f, concurrency, ordered)
+            elif threads:
+                return threaded_fragment(f, threads)
             else:
                 return fragment(f)
         return cls(map(make_fragment, seq), **kw)
@@ -96,26 +190,35 @@ class chain:
 
     def format(self):
         l = []
+        for i, step in self.numbered():
+            l.append('{:3} | {}'.format(i, describe(step)))
+        return '\n'.join(l)
+
+    def numbered(self):
+        """Yield ``(index, step)`` pairs, where ``index`` is the number shown
+        for the step by :meth:`format` (or ``''`` for internal steps)."""
         for n, step in enumerate(self.seq):
             i = n + self.index_offset + 1
             if i < 1:
                 i = ''
-            if hasattr(step, 'fragment_fn') and hasattr(step.fragment_fn, '_spy_debuginfo'):
-                desc = step.fragment_fn._spy_debuginfo[1]
-            else:
-                if hasattr(step, 'fragment_fn'):
-                    step = step.fragment_fn
-                    typ = ''
-                if hasattr(step, '__qualname__'):
-                    name = step.__qualname__
-                    typ = '<internal> '
-                else:
-                    name = 'UNKNOWN'
-                if hasattr(step, '__module__'):
-                    name = step.__module__ + '.' + name
-                desc = typ + name
-            l.append('{:3} | {}'.format(i, desc))
-        return '\n'.join(l)
+            yield i, step
+
+
+def describe(step):
+    if hasattr(step, 'fragment_fn') and hasattr(step.fragment_fn, '_spy_debuginfo'):
+        return step.fragment_fn._spy_debuginfo[1]
+    typ = ''
+    if hasattr(step, 'fragment_fn'):
+        step = step.fragment_fn
+        typ = ''
+    if hasattr(step, '__qualname__'):
+        name = step.__qualname__
+        typ = '<internal> '
+    else:
+        name = 'UNKNOWN'
+    if hasattr(step, '__module__'):
+        name = step.__module__ + '.' + name
+    return typ + name
 
 
 class many:
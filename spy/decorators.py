@@ -1,14 +1,16 @@
+from _string import formatter_field_name_split
 from functools import partial, wraps, update_wrapper
+import builtins
 import copy
 import re
 
 import clize.errors
 
 from .core import _accepts_context, _call_fragment_body, collect, DROP, many as _many
-from .objects import Context
+from .objects import Context, _wrap
 
 __all__ = ['accumulate', 'callable', 'filter', 'many', 'format', 'regex', 'keywords',
-           'focus', 'magnify', 'try_except']
+           'focus', 'focus_in_place', 'magnify', 'try_except']
 
 decorators = []
 
@@ -105,22 +107,109 @@ def many(fn, v, context):
     return _many(result)
 
 
-@decorator('--format', '-i', doc='Interpolate argument as a format string', takes_string=True, prep=lambda _: _get_formatter())
-def format(fn, v, context, formatter):
+def _base(fn):
+    while hasattr(fn, '__wrapped__'):
+        fn = fn.__wrapped__
+    return fn
+
+
+_CONVERSIONS = {'s': 'str', 'r': 'repr', 'a': 'ascii'}
+
+
+def _compile_format(template, pipe_name):
+    """Compile ``template`` into a function of the positional arguments and
+    the namespace that formats it like :meth:`string.Formatter.vformat`.
+
+    Returns the function and whether it uses any names from the namespace
+    other than ``pipe_name``, which it takes straight from the arguments, or
+    None if the template uses something the compiled code doesn't support,
+    like fields nested in format specs.
+    """
+    parts = []
+    auto = 0
+    uses_env = False
+    try:
+        parsed = list(_get_formatter().parse(template))
+        for literal, field, spec, conversion in parsed:
+            if literal:
+                parts.append(repr(literal))
+            if field is None:
+                continue
+            if '{' in spec or conversion not in _CONVERSIONS and conversion is not None:
+                return None
+            first, rest = formatter_field_name_split(field)
+            if first == '':
+                if auto is None:
+                    return None
+                first = auto
+                auto += 1
+            elif isinstance(first, int):
+                if auto:
+                    return None
+                auto = None
+            if isinstance(first, int):
+                expr = '_a[{!r}]'.format(first)
+            elif first == pipe_name:
+                expr = '_wrap(_a)'
+            else:
+                expr = '_k[{!r}]'.format(first)
+                uses_env = True
+            for is_attr, key in rest:
+                if is_attr:
+                    expr = 'getattr({}, {!r})'.format(expr, key)
+                else:
+                    expr = '{}[{!r}]'.format(expr, key)
+            if conversion is not None:
+                expr = '{}({})'.format(_CONVERSIONS[conversion], expr)
+            parts.append('format({}, {!r})'.format(expr, spec))
+    except ValueError:
+        return None
+    source = 'lambda _a, _k, _x: ' + ("''.join(({},))".format(', '.join(parts)) if parts else "''")
+    env = {'__builtins__': builtins, '_wrap': _wrap}
+    return eval(compile(source, '<spy format>', 'eval'), env), uses_env
+
+
+def _format_prep(fn):
+    base = _base(fn)
+    template = getattr(base, '_spy_literal', None)
+    if template is not None:
+        compiled = _compile_format(template, base._spy_pipe_name)
+        if compiled is not None:
+            return compiled
+    formatter = _get_formatter()
+    return (lambda v, env, x: formatter.vformat(x, v, env)), True
+
+
+@decorator('--format', '-i', doc='Interpolate argument as a format string', takes_string=True, prep=_format_prep)
+def format(fn, v, context, compiled):
+    render, uses_env = compiled
+    if not uses_env:
+        return render(v, None, None)
     env, x = fn(v, context)
-    return formatter.vformat(x, v, env)
+    return render(v, env, x)
+
+
+def _regex_prep(fn):
+    pattern = getattr(_base(fn), '_spy_literal', None)
+    if pattern is not None:
+        try:
+            return re.compile(pattern)
+        except re.error:
+            # let it be raised for the first item, as usual
+            pass
+    return None
 
 
-@decorator('--regex', '--regexp', '-R', doc='Match argument as a regexp', takes_string=True)
-def regex(fn, v, context):
+@decorator('--regex', '--regexp', '-R', doc='Match argument as a regexp', takes_string=True, prep=_regex_prep)
+def regex(fn, v, context, pattern):
+    if pattern is not None:
+        return pattern.match(v)
     env, x = fn(v, context)
     return re.match(x, v)
 
 
 def _kw_prep(fn):
-    base = fn
-    while hasattr(base, '__wrapped__'):
-        base = base.__wrapped__
+    base = _base(fn)
     if not hasattr(base, '_spy_setenv'):
         raise ValueError("inappropriate function")
     return base._spy_setenv
@@ -156,22 +245,44 @@ def _convert_focus(s):
                 break
         else:
             if len(bits) in (2,3):
-                return lenses.lens[slice(*bits)].Each()
+                return slice(*bits)
     return s
 _convert_focus.usage_name = 'ITEM'
 
 
+def _replace_item(v, key, value):
+    """Return a copy of ``v`` with ``v[key]`` replaced by ``value``.
+
+    Tuples (including namedtuples) can't be assigned to, so they're rebuilt
+    with the one slot replaced instead, sharing the other items."""
+    if isinstance(v, tuple):
+        items = list(v)
+        items[key] = value
+        return v._make(items) if hasattr(v, '_make') else tuple(items)
+    v_ = copy.copy(v)
+    v_[key] = value
+    return v_
+
+
 def _focus_prep(fn, focus):
     lenses = _get_lenses()
     if lenses is None:
         def apply(f, v):
-            v_ = copy.copy(v)
-            v_[focus] = f(v_[focus])
-            return v_
+            return _replace_item(v, focus, f(v[focus]))
         return apply
-    if not isinstance(focus, lenses.UnboundLens):
-        focus = lenses.lens[focus]
-    return lambda f, v: focus.modify(f)(v)
+    if isinstance(focus, lenses.UnboundLens):
+        return lambda f, v: focus.modify(f)(v)
+    # the common foci get the lens's setter without its optic dispatch
+    setitem = lenses.hooks.setitem
+    if isinstance(focus, slice):
+        to_iter, from_iter = lenses.hooks.to_iter, lenses.hooks.from_iter
+        def apply(f, v):
+            part = v[focus]
+            return setitem(v, focus, from_iter(part, [f(x) for x in to_iter(part)]))
+    else:
+        def apply(f, v):
+            return setitem(v, focus, f(v[focus]))
+    return apply
 
 
 @decorator('--focus', '-o', doc='Operate on an item of the input in-place',
@@ -181,15 +292,41 @@ def focus(fn, v, context, f):
     return f(fn, v)
 
 
+def _focus_in_place_prep(fn, focus):
+    lenses = _get_lenses()
+    if lenses is not None and isinstance(focus, (lenses.UnboundLens, slice)):
+        return _focus_prep(fn, focus)
+    def apply(f, v):
+        if isinstance(v, tuple):
+            return _replace_item(v, focus, f(v[focus]))
+        v[focus] = f(v[focus])
+        return v
+    return apply
+
+
+@decorator('--focus-in-place', doc='Operate on an item of the input, modifying the input itself',
+           prep=_focus_in_place_prep, dec_args=[_convert_focus])
+def focus_in_place(fn, v, context, f):
+    fn = partial(fn, context=context)
+    return f(fn, v)
+
+
 def _magnify_prep(fn, focus):
     lenses = _get_lenses()
     if lenses is None:
         def apply(f, v):
             return f(v[focus])
         return apply
-    if not isinstance(focus, lenses.UnboundLens):
-        focus = lenses.lens[focus]
-    return lambda f, v: f(focus.get()(v))
+    if isinstance(focus, lenses.UnboundLens):
+        return lambda f, v: f(focus.get()(v))
+    if isinstance(focus, slice):
+        to_iter = lenses.hooks.to_iter
+        def apply(f, v):
+            return f(list(to_iter(v[focus]))[0])
+    else:
+        def apply(f, v):
+            return f(v[focus])
+    return apply
 
 
 @decorator('--magnify', '-O', doc='Operate on and return an item of the input',
@@ -0,0 +1,189 @@
+from collections.abc import Iterable, Mapping
+import csv
+import json
+import types
+
+# Decoders keep the number and text of the line they're on in locals named
+# _spy_input_*, which the catcher uses to report malformed records.
+
+
+def _get_orjson():
+    global orjson, _get_orjson
+    try:
+        import orjson
+    except ImportError:  # pragma: no cover
+        orjson = None
+    _get_orjson = lambda: orjson
+    return orjson
+
+
+def _json_default(o):
+    if isinstance(o, Iterable):
+        return list(o)
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(o).__name__))
+
+
+_PLAIN_TYPES = frozenset([str, int, bool, type(None)])
+
+
+def _plain(thing):
+    # whether orjson encodes thing exactly like the json module would: that
+    # rules out the types only orjson knows, subclasses, non-string keys and
+    # floats it writes differently (1e16 rather than 1e+16, null for nan)
+    t = type(thing)
+    if t in _PLAIN_TYPES:
+        return True
+    if t is dict:
+        return all(type(k) is str and _plain(v) for k, v in thing.items())
+    if t is list or t is tuple:
+        return all(map(_plain, thing))
+    if t is float:
+        r = repr(thing)
+        return 'e' not in r and 'n' not in r
+    return False
+
+
+def _json_encoder():
+    encode = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'),
+                              default=_json_default).encode
+    orjson = _get_orjson()
+    if orjson is None:
+        def jsonl(thing):
+            if thing is not None:
+                return encode(thing)
+        return jsonl, False
+
+    dumps = orjson.dumps
+    error = orjson.JSONEncodeError
+
+    def jsonl(thing):
+        if thing is not None:
+            if _plain(thing):
+                try:
+                    return dumps(thing)
+                except error:
+                    # something orjson doesn't do, like a huge int
+                    pass
+            return encode(thing)
+    return jsonl, True
+
+
+def _csv_encoder(dialect):
+    # A csv.writer returns whatever its file's write() does, so this gets us
+    # each row as a string.
+    writer = csv.writer(types.SimpleNamespace(write=str), dialect, lineterminator='')
+    writerow = writer.writerow
+    header = fields = None
+
+    def encode(thing):
+        nonlocal header, fields
+        if thing is None:
+            return None
+        if isinstance(thing, Mapping):
+            if header is None:
+                header = list(thing)
+                fields = frozenset(header)
+                return writerow(header) + '\n' + writerow(thing.values())
+            if not thing.keys() <= fields:
+                # like csv.DictWriter(extrasaction='raise')
+                extra = [k for k in thing if k not in fields]
+                raise ValueError('dict contains fields not in the header: '
+                                 + ', '.join(map(repr, extra)))
+            return writerow([thing.get(k, '') for k in header])
+        if isinstance(thing, (str, bytes)) or not isinstance(thing, Iterable):
+            return writerow([thing])
+        return writerow(thing)
+    return encode, False
+
+
+ENCODERS = {
+    'jsonl': _json_encoder,
+    'csv': lambda: _csv_encoder('excel'),
+    'tsv': lambda: _csv_encoder('excel-tab'),
+    'repr': lambda: (repr, False),
+}
+
+
+def make_encoder(name):
+    """Return an ``(encode, binary)`` pair for the output format ``name``.
+
+    ``encode`` turns a result into a line of output, without a newline, or
+    None to skip the result. If ``binary`` is true it may return
+    :class:`bytes`, which should be written to the output unchanged.
+    """
+    return ENCODERS[name]()
+
+
+def _decode_jsonl(batches):
+    orjson = _get_orjson()
+    loads = orjson.loads if orjson is not None else json.loads
+    _spy_input_format = 'jsonl'  # noqa: F841
+    _spy_input_line = 0
+    for batch in batches:
+        try:
+            records = [loads(line) for line in batch if line.strip()]
+        except ValueError:
+            # hand on the records before the culprit, then fail on it
+            records = []
+            for _spy_input_record in batch:
+                _spy_input_line += 1
+                if _spy_input_record.strip():
+                    try:
+                        records.append(loads(_spy_input_record))
+                    except ValueError:
+                        if records:
+                            yield records
+                        raise
+            raise  # pragma: no cover
+        _spy_input_line += len(batch)
+        yield records
+
+
+def _decode_csv(batches, name, dialect):
+    _spy_input_format = name  # noqa: F841
+    _spy_input_line = 0
+    batch_done = False
+
+    def lines():
+        nonlocal batch_done
+        for batch in batches:
+            last = len(batch) - 1
+            for i, line in enumerate(batch):
+                batch_done = i == last
+                yield line
+
+    reader = csv.reader(lines(), dialect)
+    records = []
+    try:
+        # hand on what we have whenever a batch of lines runs out, without
+        # splitting records with quoted newlines
+        for row in reader:
+            records.append(tuple(row))
+            if batch_done:
+                batch_done = False
+                yield records
+                records = []
+    except csv.Error:
+        _spy_input_line = reader.line_num  # noqa: F841
+        if records:
+            yield records
+        raise
+    if records:
+        yield records
+
+
+DECODERS = {
+    'jsonl': _decode_jsonl,
+    'csv': lambda batches: _decode_csv(batches, 'csv', 'excel'),
+    'tsv': lambda batches: _decode_csv(batches, 'tsv', 'excel-tab'),
+}
+
+
+def decode(name, batches):
+    """Decode ``batches``, an iterable of lists of lines, in the input
+    format ``name``, yielding a list of records for each batch.
+
+    JSON Lines input may be :class:`bytes`, and blank lines are skipped. CSV
+    and TSV records are tuples of strings.
+    """
+    return DECODERS[name](batches)
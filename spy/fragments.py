@@ -1,10 +1,11 @@
+import builtins
 from builtins import print as py_print
 from collections.abc import Iterable, Mapping, Sequence
-from itertools import islice
+from itertools import islice, repeat
 
 import sys
 
-from .objects import SpyFile
+from .objects import Fields, SpyFile
 
 
 def foreach(ita):
@@ -15,28 +16,143 @@ def foreach(ita):
             yield from elem
 
 
+def make_fields(sep=None, maxsplit=0):
+    def fields(ita):
+        return map(Fields, ita, repeat(sep), repeat(maxsplit))
+    return fields
+
+
 def make_limit(*, start=0, end=None):
     def limit(ita):
         return islice(ita, start, end)
     return limit
 
 
+def _is_iterator_like(thing):
+    return not isinstance(thing, (Mapping, Sequence)) and isinstance(thing, Iterable)
+
+
+def _preview(thing):
+    sliced = []
+    for n, item in enumerate(thing):
+        if n < 5:
+            sliced.append(repr(item))
+        else:
+            sliced.append('...')
+            break
+    return "<iterable [{}]>".format(', '.join(sliced))
+
+
 def pretty_print(thing):
     if isinstance(thing, str):
         py_print(thing)
     elif not isinstance(thing, (Mapping, Sequence)) and isinstance(thing, Iterable):
-        sliced = []
-        for n, item in enumerate(thing):
-            if n < 5:
-                sliced.append(repr(item))
-            else:
-                sliced.append('...')
-                break
-        py_print("<iterable [{}]>".format(', '.join(sliced)))
+        py_print(_preview(thing))
     else:
         sys.displayhook(thing)
     return thing
 
 
+def _isatty(stream):
+    try:
+        return stream.isatty()
+    except (AttributeError, ValueError):
+        return False
+
+
+class Writer:
+    """Print results like :func:`pretty_print`, but collect them and write
+    them to ``stream`` (by default :data:`sys.stdout`) in blocks of about
+    ``buffer_size`` characters.
+
+    If ``line_buffered`` is true, or it's None and ``stream`` is a terminal,
+    the stream is flushed after each result. If ``binary`` is true, bytes-like
+    results are written to the stream's binary buffer as they are. If
+    ``encoder`` is given, it's used to turn each result into a line instead;
+    see :func:`spy.formats.make_encoder`.
+    """
+
+    def __init__(self, stream=None, buffer_size=1 << 16, line_buffered=None, binary=False,
+                 encoder=None):
+        self.stream = stream = stream or sys.stdout
+        if line_buffered is None:
+            line_buffered = _isatty(stream)
+        self.line_buffered = line_buffered
+        self.buffer_size = 0 if line_buffered else buffer_size
+        self.binary = binary
+        self._encoder = encoder
+        if binary:
+            self._out = stream.buffer
+            self._newline = b'\n'
+            self._encoding = stream.encoding or 'utf-8'
+            self._errors = stream.errors or 'strict'
+        else:
+            self._out = stream
+            self._newline = '\n'
+        self._parts = []
+        self._size = 0
+
+    def _format(self, thing):
+        if isinstance(thing, str):
+            return thing
+        if not isinstance(thing, (Mapping, Sequence)) and isinstance(thing, Iterable):
+            return _preview(thing)
+        if sys.displayhook is not sys.__displayhook__:
+            self.flush()
+            sys.displayhook(thing)
+            self.stream.flush()
+            return None
+        if thing is None:
+            return None
+        builtins._ = thing
+        return repr(thing)
+
+    def write(self, thing):
+        if self._encoder is not None:
+            s = self._encoder(thing)
+            if s is None:
+                return thing
+            if self.binary and isinstance(s, str):
+                s = s.encode(self._encoding, self._errors)
+            return self._append(s, thing)
+        # records print as the line they came from
+        value = thing.line if type(thing) is Fields else thing
+        if self.binary and isinstance(value, (bytes, bytearray, memoryview)):
+            s = value
+        else:
+            s = self._format(value)
+            if s is None:
+                return thing
+            if self.binary:
+                s = s.encode(self._encoding, self._errors)
+        return self._append(s, thing)
+
+    def _append(self, s, thing):
+        self._parts.append(s)
+        self._size += len(s) + 1
+        if self._size >= self.buffer_size:
+            self.flush()
+        return thing
+
+    def flush(self):
+        if self._parts:
+            out = self._out
+            out.write(self._newline.join(self._parts))
+            out.write(self._newline)
+            self._parts = []
+            self._size = 0
+        if self.line_buffered:
+            self._out.flush()
+
+
+def make_print(writer):
+    def print(ita):
+        try:
+            yield from map(writer.write, ita)
+        finally:
+            writer.flush()
+    return print
+
+
 def print(ita):
-    return map(pretty_print, ita)
+    return make_print(Writer())(ita)
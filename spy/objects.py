@@ -1,27 +1,59 @@
+from array import array
 from bisect import bisect_left
+from collections import OrderedDict
+from collections.abc import Sequence
 from functools import wraps
 from importlib import import_module
+from itertools import accumulate, chain, islice
+import codecs
 import io
 from io import TextIOBase, UnsupportedOperation
+import mmap
+import os
 from reprlib import recursive_repr
+import stat
 from types import ModuleType
+from weakref import WeakSet
 import operator
 import math
 
 
-class _Wrapper(dict):
+# Types that are never callable and so never need wrapping; looking these up
+# is much cheaper than hashing them into the cache below.
+_PLAIN_TYPES = frozenset([str, bytes, bytearray, int, float, complex, bool,
+                          tuple, list, dict, set, frozenset, type(None)])
+
+
+class _WrapperCache(OrderedDict):
+    """An LRU cache of callables to their :class:`_FunctionWrapper`, so that
+    repeated lookups of the same function don't allocate."""
+
+    def __init__(self, maxsize):
+        super().__init__()
+        self.maxsize = maxsize
+
     def __missing__(self, x):
-        if hasattr(x, '__call__') and (not isinstance(x, type) or not issubclass(x, BaseException)):
-            self[x] = w = _FunctionWrapper(x)
-            return w
-        self[x] = x
-        return x
+        self[x] = w = _FunctionWrapper(x)
+        if len(self) > self.maxsize:
+            self.popitem(last=False)
+        return w
+
 
-def _wrap(x, _wrapper=_Wrapper()):
+def _wrap(x, _cache=_WrapperCache(1024)):
+    if type(x) in _PLAIN_TYPES or not hasattr(x, '__call__'):
+        return x
+    if isinstance(x, type) and issubclass(x, BaseException):
+        return x
     try:
-        return _wrapper[x]
+        w = _cache[x]
     except TypeError:
         return x
+    try:
+        _cache.move_to_end(x)
+    except KeyError:  # pragma: no cover
+        # evicted by another thread in the meantime
+        pass
+    return w
 
 
 class _ModuleProxy:
@@ -166,9 +198,9 @@ class _FunctionWrapper:
 class _ContextInjector(_ModuleProxy):
     __slots__ = ('_ContextInjector__context',)
 
-    def __init__(self, module):
+    def __init__(self, module, context=None):
         super().__init__(module)
-        self.__context = None
+        self.__context = context
 
     def __getattr__(self, k):
         v = super().__getattr__(k)
@@ -243,8 +275,99 @@ class _ContextView:
             self.__class__.__name__, repr(self.context), repr(self.overlay))
 
 
+class Fields:
+    """A line split into fields on ``sep`` (or whitespace, if it's None),
+    which acts like a tuple of them.
+
+    The line is only split when a field is needed, and only as far as the
+    field asked for, or ``maxsplit`` if that's further.
+    """
+
+    __slots__ = ('line', 'sep', 'maxsplit', '_fields', '_complete')
+
+    def __init__(self, line, sep=None, maxsplit=0):
+        self.line = line
+        self.sep = sep
+        self.maxsplit = maxsplit
+        self._fields = None
+        self._complete = False
+
+    def _split(self, k=None):
+        if k is None:
+            fields = self.line.split(self.sep)
+            self._complete = True
+        else:
+            n = max(k, self.maxsplit) + 1
+            fields = self.line.split(self.sep, n)
+            self._complete = len(fields) <= n
+        self._fields = fields
+        return fields
+
+    def _all(self):
+        if self._complete:
+            return self._fields
+        return self._split()
+
+    def __getitem__(self, k):
+        if isinstance(k, int) and k >= 0:
+            fields = self._fields
+            if fields is None or not self._complete and k >= len(fields) - 1:
+                fields = self._split(k)
+            return fields[k]
+        if isinstance(k, slice):
+            return tuple(self._all()[k])
+        return self._all()[k]
+
+    def __len__(self):
+        return len(self._all())
+
+    def __iter__(self):
+        return iter(self._all())
+
+    def __eq__(self, other):
+        if isinstance(other, Fields):
+            other = tuple(other)
+        return tuple(self) == other
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __str__(self):
+        return str(self.line)
+
+    def __repr__(self):
+        return repr(tuple(self))
+
+
+def _split_lines(text):
+    start = 0
+    while True:
+        end = text.find('\n', start) + 1
+        if not end:
+            if start < len(text):
+                yield text[start:]
+            return
+        yield text[start:end]
+        start = end
+
+
 class SpyFile(TextIOBase):
-    def __init__(self, stream):
+    """A text stream wrapper that remembers lines as they're read, so that
+    the stream can be indexed, sliced and seeked in.
+
+    If ``forward_only`` is true, lines that every iterator over the file has
+    gone past are released. Using the file in any other way before that
+    happens turns this off; doing it afterwards raises
+    :exc:`io.UnsupportedOperation`.
+    """
+
+    _forward_only = False
+    # how many lines have been released from the start of self.lines
+    _base = 0
+    # how many lines iterators may get ahead of each other before we check
+    _release_every = 4096
+
+    def __init__(self, stream, forward_only=False):
         self.stream = stream
         self.lines = []
         self.row = 0
@@ -253,9 +376,46 @@ class SpyFile(TextIOBase):
         self.offset = 0
         self._append = self.lines.append
         self._next = iter(self.stream).__next__
+        self._exhausted = False
+        if forward_only:
+            self._forward_only = True
+            self._readers = WeakSet()
+            self._release_at = 0
+
+    def _retain(self):
+        if self._forward_only:
+            if self._base:
+                raise UnsupportedOperation(
+                    'lines of a forward-only SpyFile have already been released')
+            self._forward_only = False
+
+    def _reader_line(self, row):
+        if not self._forward_only:
+            return self[row]
+        base = self._base
+        if row < base:
+            raise UnsupportedOperation('line {} has already been released'.format(row))
+        lines = self.lines
+        while base + len(lines) <= row:
+            if not self._read_one():
+                raise IndexError(row)
+        line = lines[row - base]
+        if row >= self._release_at:
+            self._release()
+            self._release_at = row + self._release_every
+        return line
+
+    def _release(self):
+        n = min(reader._row for reader in self._readers) - self._base
+        if n > 0:
+            del self.lines[:n]
+            del self.rowoff[:n]
+            self._base += n
 
     def __getitem__(self, k):
-        if isinstance(k, slice):
+        self._retain()
+        if isinstance(k, slice) or k < 0:
+            # these depend on where the file ends
             while self._read_one():
                 pass
             return self.lines[k]
@@ -267,11 +427,13 @@ class SpyFile(TextIOBase):
         raise IndexError(k)
 
     def __len__(self):
+        self._retain()
         while self._read_one():
             pass
         return len(self.lines)
 
     def __str__(self):
+        self._retain()
         while self._read_one():
             pass
         return '\n'.join(self.lines)
@@ -296,6 +458,7 @@ class SpyFile(TextIOBase):
             return False
 
     def seek(self, offset, whence=io.SEEK_SET):
+        self._retain()
         if whence == io.SEEK_SET:
             pass
         elif whence == io.SEEK_CUR:
@@ -318,41 +481,69 @@ class SpyFile(TextIOBase):
             row -= 1
         self.row = row
         self.col = offset - self.rowoff[row]
+        self.offset = offset
+        self._exhausted = False
         return offset
 
+    def _fill(self, k):
+        while len(self.lines) <= k and self._read_one():
+            pass
+        return len(self.lines) > k
+
+    def _read_all(self):
+        # Nothing has been read from the stream yet, so we can read it in one
+        # go; lines are indexed from the result later if they're needed.
+        if self.lines:
+            return None
+        text = self.stream.read()
+        self._next = _split_lines(text).__next__
+        if text.endswith('\n'):
+            text = text[:-1]
+        return text
+
     def read(self, n=None):
-        if n == 0:
+        self._retain()
+        if n == 0 or self._exhausted:
             return ''
-        buf = ''
-        try:
-            while n is None or len(buf) < n:
-                row = self[self.row]
-                try:
-                    self[self.row + 1]
-                    row += '\n'
-                except IndexError:
-                    pass
-                start = self.col
-                if n is not None:
-                    end = start + n - len(buf)
-                    buf += row[start:end]
-                else:
-                    buf += row[start:]
-                if n is None or end >= len(row):
-                    self.row += 1
-                    self.col = 0
-                else:
-                    self.col = end
-        except IndexError:
-            pass
+        if n is not None and n < 0:
+            n = None
+        if n is None and self.row == 0 and self.col == 0:
+            buf = self._read_all()
+            if buf is not None:
+                self.offset = len(buf)
+                self._exhausted = True
+                return buf
+        parts = []
+        remaining = n
+        lines = self.lines
+        while remaining is None or remaining > 0:
+            k = self.row
+            if len(lines) <= k + 1 and not self._fill(k + 1) and k >= len(lines):
+                break
+            row = lines[k]
+            if k + 1 < len(lines):
+                row += '\n'
+            start = self.col
+            if remaining is None:
+                part = row[start:]
+            else:
+                part = row[start:start + remaining]
+                remaining -= len(part)
+            parts.append(part)
+            if start + len(part) >= len(row):
+                self.row += 1
+                self.col = 0
+            else:
+                self.col = start + len(part)
+        buf = ''.join(parts)
         self.offset += len(buf)
         return buf
 
     def readline(self, n=-1):
-        try:
-            row = self[self.row][self.col:] + '\n'
-        except IndexError:
+        self._retain()
+        if self._exhausted or not self._fill(self.row):
             return ''
+        row = self.lines[self.row][self.col:] + '\n'
         if len(row) >= n >= 0:
             self.col += n
             self.offset += n
@@ -363,14 +554,228 @@ class SpyFile(TextIOBase):
             self.offset += len(row)
             return row
 
+    def readlines(self, hint=-1):
+        lines = []
+        size = 0
+        for line in iter(self.readline, ''):
+            lines.append(line)
+            size += len(line)
+            if 0 < hint <= size:
+                break
+        return lines
+
     def detach(self):
         raise UnsupportedOperation
 
 
+# Encodings in which b'\n' is always a newline and never part of another
+# character, so the raw data can be split on it before decoding.
+_MAPPABLE_ENCODINGS = frozenset(['utf-8', 'ascii', 'iso8859-1'])
+
+
+class _MappedLines:
+    __slots__ = ('_file',)
+
+    def __init__(self, f):
+        self._file = f
+
+    def __len__(self):
+        return len(self._file._starts) - 1
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            return [self[i] for i in range(*k.indices(len(self)))]
+        n = len(self)
+        if k < 0:
+            k += n
+        if not 0 <= k < n:
+            raise IndexError(k)
+        return self._file._line(k)
+
+
+class MappedSpyFile(SpyFile):
+    """A :class:`SpyFile` over a regular file, which is memory-mapped rather
+    than read into memory. Lines are only decoded when they're accessed, and
+    the index of where they start is kept in an :class:`array.array`.
+
+    ``source`` is a path or a file object open on a regular file, in which
+    case its encoding is used and the data is read from its current
+    position. Raises :exc:`ValueError` if the file can't be mapped.
+    """
+
+    chunk_size = 1 << 20
+
+    def __init__(self, source, encoding='utf-8', errors='strict'):
+        if isinstance(source, (str, bytes, os.PathLike)):
+            with open(source, 'rb') as f:
+                self._init_map(f.fileno(), 0)
+        else:
+            encoding = getattr(source, 'encoding', None) or encoding
+            errors = getattr(source, 'errors', None) or errors
+            fd = source.fileno()
+            self._init_map(fd, os.lseek(fd, 0, os.SEEK_CUR))
+        if codecs.lookup(encoding).name not in _MAPPABLE_ENCODINGS:
+            self._map.close()
+            raise ValueError("can't map {} data".format(encoding))
+        self.stream = source
+        self._encoding = encoding
+        self._errors = errors
+        self.lines = _MappedLines(self)
+        self.row = 0
+        self.col = 0
+        self.offset = 0
+        self._exhausted = False
+        self._pos = self._start
+        self._starts = array('q', [0])
+        # While everything indexed is ASCII without any \r, character offsets
+        # are the same as byte offsets and we don't need to keep both.
+        self._chars = None
+
+    def _init_map(self, fd, start):
+        st = os.fstat(fd)
+        if not stat.S_ISREG(st.st_mode) or st.st_size <= start:
+            raise ValueError('not a non-empty regular file')
+        self._map = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+        self._start = start
+        self._end = len(self._map)
+
+    @property
+    def encoding(self):
+        return self._encoding
+
+    @property
+    def errors(self):
+        return self._errors
+
+    def __str__(self):
+        text = self._decode(self._map[self._start:self._end])
+        if text.endswith('\n'):
+            text = text[:-1]
+        return text
+
+    def __getitem__(self, k):
+        if isinstance(k, slice) or k < 0:
+            return super().__getitem__(k)
+        if not self._fill(k):
+            raise IndexError(k)
+        return self._line(k)
+
+    def _fill(self, k):
+        while len(self._starts) <= k + 1 and self._read_one():
+            pass
+        return len(self._starts) > k + 1
+
+    def _read_all(self):
+        return str(self)
+
+    def readline(self, n=-1):
+        if n < 0 and not self._exhausted and self._fill(self.row) and self._chars is None:
+            row = self.row
+            a = self._start + self._starts[row] + self.col
+            b = self._start + self._starts[row + 1] - 1
+            self.row += 1
+            self.col = 0
+            self.offset = self._starts[row + 1]
+            return self._map[a:b].decode('ascii') + '\n'
+        return super().readline(n)
+
+    def read(self, n=None):
+        if n is None or n <= 0 or self._exhausted:
+            return super().read(n)
+        # While the data is plain ASCII, offsets are byte offsets and we can
+        # slice the map directly.
+        want = self.offset + n
+        while self._starts[-1] <= want and self._read_one():
+            pass
+        if self._chars is not None:
+            return super().read(n)
+        limit = self._starts[-1]
+        done = self._pos >= self._end
+        if done:
+            limit -= 1
+        end = min(want, limit)
+        buf = self._map[self._start + self.offset:self._start + end].decode('ascii')
+        if done and end == limit:
+            self.row = len(self.lines)
+            self.col = 0
+            self.offset = end
+        else:
+            self.seek(end)
+        return buf
+
+    def _decode(self, b):
+        text = b.decode(self._encoding, self._errors)
+        if '\r' in text:
+            text = text.replace('\r\n', '\n')
+        return text
+
+    def _chunk_end(self, pos):
+        end = pos + self.chunk_size
+        if end >= self._end:
+            return self._end
+        nl = self._map.rfind(b'\n', pos, end)
+        if nl == -1:
+            nl = self._map.find(b'\n', end)
+            if nl == -1:
+                return self._end
+        return nl + 1
+
+    def _line(self, k):
+        a = self._start + self._starts[k]
+        b = self._start + self._starts[k + 1] - 1
+        if b < self._end and self._map[b - 1:b] == b'\r':
+            b -= 1
+        return self._map[a:b].decode(self._encoding, self._errors)
+
+    def _line_iter(self):
+        pos = self._start
+        while pos < self._end:
+            end = self._chunk_end(pos)
+            text = self._decode(self._map[pos:end])
+            lines = text.split('\n')
+            if not lines[-1]:
+                lines.pop()
+            yield from lines
+            pos = end
+
+    def _read_one(self):
+        # Index a chunk of lines at a time, which is a lot faster than
+        # searching for each newline.
+        pos = self._pos
+        if pos >= self._end:
+            return False
+        end = self._chunk_end(pos)
+        chunk = self._map[pos:end]
+        if self._chars is None and not (chunk.isascii() and b'\r' not in chunk):
+            self._chars = array('q', self._starts)
+        lines = chunk.split(b'\n')
+        if not lines[-1]:
+            lines.pop()
+        starts = accumulate(chain([self._starts[-1]], (len(l) + 1 for l in lines)))
+        self._starts.extend(islice(starts, 1, None))
+        self._pos = end
+        return True
+
+    @property
+    def rowoff(self):
+        chars = self._chars
+        if chars is None:
+            return self._starts
+        for i in range(len(chars) - 1, len(self._starts) - 1):
+            chars.append(chars[-1] + len(self._line(i)) + 1)
+        return chars
+
+    def close(self):
+        self._map.close()
+        super().close()
+
+
 class SpyFileReader:
     def __init__(self, spyfile):
         self._spyfile = spyfile
         self._row = 0
+        if spyfile._forward_only:
+            spyfile._readers.add(self)
 
     def __iter__(self):
         return self
@@ -379,6 +784,9 @@ class SpyFileReader:
         row = self._row
         self._row += 1
         try:
-            return self._spyfile[row]
+            return self._spyfile._reader_line(row)
         except IndexError:
             raise StopIteration
+
+
+Sequence.register(Fields)
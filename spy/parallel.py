@@ -0,0 +1,60 @@
+from collections import deque
+from itertools import islice
+import multiprocessing
+
+from . import catcher
+from .core import chain
+
+
+_worker_chain = None
+_worker_handle_exceptions = True
+
+
+def _have_fork():
+    try:
+        multiprocessing.get_context('fork')
+    except ValueError:  # pragma: no cover
+        return False
+    return True
+
+
+def _init_worker(make_steps, index_offset, handle_exceptions):
+    global _worker_chain, _worker_handle_exceptions
+    _worker_chain = chain(make_steps(), index_offset=index_offset)
+    _worker_handle_exceptions = handle_exceptions
+
+
+def _run_chunk(chunk):
+    if not _worker_handle_exceptions:
+        return list(_worker_chain.apply(chunk))
+    with catcher.handler(delete_all=True):
+        return list(_worker_chain.apply(chunk))
+
+
+def process_map(make_steps, ita, *, processes, chunksize=512, index_offset=0,
+                handle_exceptions=True):
+    """Run the steps returned by ``make_steps()`` over ``ita`` in a pool of
+    ``processes`` worker processes, yielding results in input order.
+
+    ``make_steps`` is called once in each worker, so it can set up whatever
+    state the steps need there.
+    """
+    ctx = multiprocessing.get_context('fork')
+    pool = ctx.Pool(processes, _init_worker,
+                    (make_steps, index_offset, handle_exceptions))
+    try:
+        ita = iter(ita)
+        pending = deque()
+        while True:
+            while len(pending) < processes * 2:
+                chunk = list(islice(ita, chunksize))
+                if not chunk:
+                    break
+                pending.append(pool.apply_async(_run_chunk, (chunk,)))
+            if not pending:
+                break
+            yield from pending.popleft().get()
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
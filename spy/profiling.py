@@ -0,0 +1,210 @@
+from collections import Counter
+from contextlib import contextmanager
+import cProfile
+import os.path
+import pstats
+import signal
+
+from . import core, decorators
+
+
+# Frames in these files are spy's own plumbing. Like the catcher does for
+# tracebacks, we leave them out of stacks so their time is attributed to
+# whatever called them.
+_INTERNAL_FILES = frozenset(
+    os.path.join(os.path.dirname(__file__), name + '.py')
+    for name in ('catcher', 'cli', 'core', 'decorators', 'objects', 'stats'))
+
+_PIPELINE_FILENAME = '<spy pipeline>'
+
+
+def _clean(label):
+    return ' '.join(label.split()).replace(';', ':')
+
+
+def fragment_labels(debuginfos):
+    """Map the filenames fragments are compiled with to a label including
+    their source."""
+    return {name: _clean('{}: {}'.format(name, source)) for name, source in debuginfos}
+
+
+def _label(labels, filename, funcname):
+    label = labels[filename]
+    if funcname not in ('<module>', '<fragment>'):
+        label += ' ' + funcname
+    return label
+
+
+def _relabel(key, labels):
+    filename, lineno, funcname = key
+    if filename in labels:
+        return filename, lineno, _label(labels, filename, funcname)
+    if filename == decorators.__file__ and funcname in decorators.__all__:
+        # a decorator's own code, named like pstats names built-ins
+        return '~', 0, 'decorator ' + getattr(decorators, funcname).decorator_names[0]
+    return key
+
+
+# where internal time ends up when nothing outside spy called it, named like
+# pstats names built-ins
+_ROOT = ('~', 0, 'spy')
+
+
+def _add(a, b):
+    return b if a is None else tuple(x + y for x, y in zip(a, b))
+
+
+def _merge(stats, key, entry):
+    cc, nc, tt, ct, callers = entry
+    if key in stats:
+        cc_, nc_, tt_, ct_, callers_ = stats[key]
+        for c, v in callers.items():
+            callers_[c] = _add(callers_.get(c), v)
+        entry = cc + cc_, nc + nc_, tt + tt_, ct + ct_, callers_
+    stats[key] = entry
+
+
+def _fold(stats, key):
+    # take out an internal function, giving its own time to its callers and
+    # its callees to its callers, in proportion to how much each called it
+    cc, nc, tt, ct, callers = stats.pop(key)
+    callers = {c: v for c, v in callers.items() if c != key}
+    if not callers:
+        _merge(stats, _ROOT, (cc, nc, tt, ct, {}))
+        callers = {_ROOT: (nc, cc, tt, ct)}
+    else:
+        for c, (_, _, c_tt, _) in callers.items():
+            c_cc, c_nc, c_tt_, c_ct, c_callers = stats[c]
+            stats[c] = c_cc, c_nc, c_tt_ + c_tt, c_ct, c_callers
+    total = sum(v[3] for v in callers.values())
+    for entry in stats.values():
+        via = entry[4].pop(key, None)
+        if via is None:
+            continue
+        for c, v in callers.items():
+            share = v[3] / total if total else 1 / len(callers)
+            part = tuple(round(x * share) for x in via[:2]) + tuple(x * share for x in via[2:])
+            entry[4][c] = _add(entry[4].get(c), part)
+
+
+def _fold_stats(stats, labels):
+    """Relabel fragments' entries in pstats ``stats`` and fold spy's own
+    plumbing into whatever called it, like :class:`Sampler` does for
+    stacks."""
+    relabelled = {}
+    for key, (cc, nc, tt, ct, callers) in stats.items():
+        callers_ = {}
+        for c, v in callers.items():
+            c = _relabel(c, labels)
+            callers_[c] = _add(callers_.get(c), v)
+        _merge(relabelled, _relabel(key, labels), (cc, nc, tt, ct, callers_))
+    for key in [key for key in relabelled if key[0] in _INTERNAL_FILES]:
+        _fold(relabelled, key)
+    return relabelled
+
+
+@contextmanager
+def cprofile(path, labels):
+    """Profile the body with :mod:`cProfile` and save the statistics to
+    ``path``, naming fragments' code after their source and leaving out
+    spy's internals."""
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield profile
+    finally:
+        profile.disable()
+        st = pstats.Stats(profile)
+        st.stats = _fold_stats(st.stats, labels)
+        st.dump_stats(path)
+
+
+def _frame_label(frame, labels):
+    code = frame.f_code
+    filename = code.co_filename
+    if filename in labels:
+        return _label(labels, filename, code.co_name)
+    if filename == _PIPELINE_FILENAME:
+        info = frame.f_globals.get('_spy_linemap', {}).get(frame.f_lineno)
+        if info is None:
+            return 'spy pipeline'
+        (name, _), decorator = info
+        label = labels.get(name, name)
+        if decorator is not None:
+            label += ' decorator ' + decorator.__qualname__
+        return label
+    if filename == decorators.__file__ and code.co_name == 'wrapped':
+        local = frame.f_locals
+        decorator = local.get('_spy_decorator')
+        debuginfo = getattr(local.get('_spy_callable'), '_spy_debuginfo', None)
+        if decorator is not None and debuginfo is not None:
+            return '{} decorator {}'.format(labels.get(debuginfo[0], debuginfo[0]),
+                                            decorator.__qualname__)
+    if filename in _INTERNAL_FILES:
+        return None
+    return _clean('{} ({}:{})'.format(code.co_name, os.path.basename(filename),
+                                      code.co_firstlineno))
+
+
+def _is_root(frame):
+    return (frame.f_code is core.chain.run_to_exhaustion.__code__ or
+            frame.f_code.co_filename == _PIPELINE_FILENAME)
+
+
+class Sampler:
+    """Periodically sample the stack of the main thread, folding spy
+    internals, and count the distinct stacks seen.
+
+    Samples are taken from a ``SIGPROF`` handler every ``interval`` seconds
+    of CPU time.
+    """
+
+    def __init__(self, labels, interval=0.001):
+        self.labels = labels
+        self.interval = interval
+        self.counts = Counter()
+
+    def start(self):
+        self._old_handler = signal.signal(signal.SIGPROF, self._handle)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self._old_handler)
+
+    def _handle(self, signum, frame):
+        self.sample(frame)
+
+    def sample(self, frame):
+        stack = []
+        while frame is not None and not _is_root(frame):
+            label = _frame_label(frame, self.labels)
+            if label is not None:
+                stack.append(label)
+            frame = frame.f_back
+        if frame is None:
+            # not inside the chain yet
+            return
+        if frame.f_code.co_filename == _PIPELINE_FILENAME:
+            stack.append(_frame_label(frame, self.labels))
+        stack.append('spy')
+        stack.reverse()
+        self.counts[';'.join(stack)] += 1
+
+    def write(self, file):
+        for stack, count in sorted(self.counts.items()):
+            print(stack, count, file=file)
+
+
+@contextmanager
+def flamegraph(path, labels):
+    """Sample the stack while running the body and save the result to
+    ``path`` in the collapsed stack format used by flamegraph tools."""
+    sampler = Sampler(labels)
+    sampler.start()
+    try:
+        yield sampler
+    finally:
+        sampler.stop()
+        with open(path, 'w') as f:
+            sampler.write(f)
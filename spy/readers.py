@@ -0,0 +1,585 @@
+import codecs
+import ctypes
+import ctypes.util
+import heapq
+from importlib import import_module
+import io
+from itertools import count, repeat
+import mmap
+from operator import itemgetter
+import os
+import locale
+import queue
+import re
+import select
+import stat
+import threading
+import time
+
+
+def _line_batches(read, block_size, split):
+    rest = None
+    while True:
+        block = read(block_size)
+        if not block:
+            if rest:
+                yield [rest]
+            return
+        lines = split(rest + block if rest else block)
+        rest = lines.pop()
+        if lines:
+            yield lines
+
+
+def read_line_batches(stream, block_size=1 << 16):
+    """Yield lists of the lines of the binary ``stream`` as :class:`bytes`,
+    without their trailing newlines, one list for each block read."""
+    read = getattr(stream, 'read1', stream.read)
+    return _line_batches(read, block_size, lambda b: b.split(b'\n'))
+
+
+def read_lines(stream, block_size=1 << 16):
+    """Yield lines of the binary ``stream`` as :class:`bytes`, without their
+    trailing newlines, reading it a block at a time."""
+    for batch in read_line_batches(stream, block_size):
+        yield from batch
+
+
+def _split_text(text):
+    lines = text.split('\n')
+    for i in range(len(lines) - 1):
+        lines[i] += '\n'
+    return lines
+
+
+def read_text_batches(stream, block_size=1 << 16):
+    """Yield lists of the lines of the text ``stream``, including their
+    newlines, one list for each block read.
+
+    Text streams with a binary buffer are read a block at a time from it and
+    decoded like :data:`sys.stdin` is, so a batch never waits for more input
+    than is available."""
+    if getattr(stream, 'buffer', None) is None:
+        return iter(lambda: stream.readlines(block_size), [])
+    return _line_batches(_text_reader(stream), block_size, _split_text)
+
+
+def _text_reader(stream):
+    """Return a function reading decoded text from the text ``stream`` with
+    universal newlines, from its buffer if it has one, so that a read never
+    waits for more input than is available."""
+    buffer = getattr(stream, 'buffer', None)
+    if buffer is None:
+        return stream.read
+    decoder = codecs.getincrementaldecoder(stream.encoding)(stream.errors or 'strict')
+    decoder = io.IncrementalNewlineDecoder(decoder, translate=True)
+    read = getattr(buffer, 'read1', buffer.read)
+
+    def read_text(n):
+        # the decoder can hold on to a whole block's worth of data, which
+        # mustn't look like the end of the stream
+        while True:
+            block = read(n)
+            text = decoder.decode(block, final=not block)
+            if text or not block:
+                return text
+    return read_text
+
+
+def scannable(pattern):
+    """Return whether the compiled ``pattern`` can be searched for in a block
+    of lines to find the lines it matches at the start of.
+
+    Searching a block can only find more candidates than matching each line
+    would, except with constructs that look beyond the line or depend on
+    where the string ends, so patterns using those aren't scannable."""
+    source = pattern.pattern
+    if isinstance(source, bytes):
+        source = source.decode('latin-1')
+    return not (pattern.flags & re.DOTALL or
+                any(s in source for s in ('\\A', '\\Z', '(?<', '(?!')))
+
+
+def _match_block(block, end, search, match, nl):
+    pos = 0
+    while pos < end:
+        m = search(block, pos, end)
+        if m is None:
+            break
+        s = m.start()
+        start = block.rfind(nl, pos, s) + 1 or pos
+        yield from repeat(None, block.count(nl, pos, start))
+        stop = block.index(nl, s)
+        # the match only counts if it's at the start of the line, and even
+        # then it might have relied on what comes after the line
+        yield match(block[start:stop]) if s == start else None
+        pos = stop + 1
+    yield from repeat(None, block.count(nl, pos, end))
+
+
+def _line_blocks(stream, binary, block_size):
+    # yield (block, end) pairs, where block[:end] is whole lines
+    if binary:
+        read = getattr(stream, 'read1', stream.read)
+        nl = b'\n'
+    else:
+        read = _text_reader(stream)
+        nl = '\n'
+    rest = nl[:0]
+    while True:
+        block = read(block_size)
+        if not block:
+            if rest:
+                yield rest + nl, len(rest) + 1
+            return
+        if rest:
+            block = rest + block
+        end = block.rfind(nl) + 1
+        rest = block[end:]
+        yield block, end
+
+
+def match_lines(stream, pattern, block_size=1 << 20, filter=False):
+    """Yield ``pattern.match(line)`` for each line of ``stream``, without the
+    newline, like matching each line in turn would.
+
+    The stream is binary if ``pattern`` is a bytes pattern and text
+    otherwise. It's read a block at a time, and the block is searched for
+    the pattern (which must be :func:`scannable`), so only lines that might
+    match are made into strings; None is yielded for the others.
+
+    If ``filter`` is true, the lines that match are yielded instead, and
+    nothing for the others.
+    """
+    binary = isinstance(pattern.pattern, bytes)
+    nl = b'\n' if binary else '\n'
+    search = re.compile(pattern.pattern, pattern.flags | re.MULTILINE).search
+    match = pattern.match
+    for block, end in _line_blocks(stream, binary, block_size):
+        if filter:
+            yield from _filter_block(block, end, search, match, nl)
+        else:
+            yield from _match_block(block, end, search, match, nl)
+
+
+def _filter_block(block, end, search, match, nl):
+    pos = 0
+    while pos < end:
+        m = search(block, pos, end)
+        if m is None:
+            break
+        s = m.start()
+        start = block.rfind(nl, pos, s) + 1 or pos
+        stop = block.index(nl, s)
+        if s == start:
+            line = block[start:stop]
+            if match(line):
+                yield line
+        pos = stop + 1
+
+
+def _find_block(block, end, needle, nl):
+    find = block.find
+    pos = 0
+    while pos < end:
+        s = find(needle, pos, end)
+        if s < 0:
+            break
+        start = block.rfind(nl, pos, s) + 1 or pos
+        stop = block.index(nl, s)
+        yield block[start:stop]
+        pos = stop + 1
+
+
+def find_lines(stream, needle, block_size=1 << 20):
+    """Yield each line of ``stream`` that contains ``needle``, without the
+    newline, like testing ``needle in line`` for each line in turn would.
+
+    The stream is binary if ``needle`` is bytes and text otherwise, and
+    ``needle`` mustn't contain a newline. It's read a block at a time, and
+    the block is searched for ``needle``, so lines that don't contain it are
+    never made into strings at all.
+    """
+    binary = isinstance(needle, bytes)
+    nl = b'\n' if binary else '\n'
+    if nl in needle:
+        raise ValueError("needle mustn't contain a newline")
+    for block, end in _line_blocks(stream, binary, block_size):
+        yield from _find_block(block, end, needle, nl)
+
+
+def read_buffer(stream):
+    """Return the rest of the binary ``stream`` as a :class:`memoryview`.
+
+    If it's a regular file, it's memory-mapped rather than read."""
+    try:
+        fd = stream.fileno()
+        if stat.S_ISREG(os.fstat(fd).st_mode):
+            start = os.lseek(fd, 0, os.SEEK_CUR)
+            m = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+            return memoryview(m)[start:]
+    except (OSError, ValueError):
+        # not a file, or an empty one
+        pass
+    return memoryview(stream.read())
+
+
+class _Failure:
+    def __init__(self, exc):
+        self.exc = exc
+
+
+_END = object()
+
+
+class ReadAhead:
+    """Iterate over the items in ``batches``, an iterable of lists, which is
+    consumed in a background thread up to ``size`` lists ahead.
+
+    Records how full the queue is each time a batch is taken from it.
+    """
+
+    def __init__(self, batches, size=16, name=None):
+        self.size = size
+        self.name = name
+        self.gets = 0
+        self.fill = 0
+        self.waits = 0
+        self._queue = queue.Queue(size)
+        self._thread = threading.Thread(target=self._run, args=(batches,), daemon=True)
+        self._thread.start()
+
+    def _run(self, batches):
+        put = self._queue.put
+        try:
+            for batch in batches:
+                put(batch)
+        except BaseException as e:
+            put(_Failure(e))
+        else:
+            put(_END)
+
+    def __iter__(self):
+        q = self._queue
+        while True:
+            n = q.qsize()
+            self.gets += 1
+            self.fill += n
+            if not n:
+                self.waits += 1
+            batch = q.get()
+            if batch is _END:
+                q.put(_END)
+                return
+            if isinstance(batch, _Failure):
+                q.put(batch)
+                raise batch.exc
+            yield from batch
+
+    def read(self):
+        return ''.join(self)
+
+    def format(self):
+        mean = self.fill / self.gets if self.gets else 0
+        return 'queue size {}, mean fill {:.1f} ({:.0%}), empty on {} of {} reads'.format(
+            self.size, mean, mean / self.size, self.waits, self.gets)
+
+
+_MAGIC = re.compile(rb'(\x1f\x8b)|(BZh[1-9])|(\xfd7zXZ\x00)')
+_MODULES = (None, 'gzip', 'bz2', 'lzma')
+
+
+def _head(stream, n):
+    try:
+        fd = stream.fileno()
+        if stat.S_ISREG(os.fstat(fd).st_mode):
+            # read it from the file directly: peeking would fill the buffer,
+            # moving the file position out from under anything that maps it
+            pos = os.lseek(fd, 0, os.SEEK_CUR)
+            try:
+                return os.read(fd, n)
+            finally:
+                os.lseek(fd, pos, os.SEEK_SET)
+    except (OSError, ValueError):
+        pass
+    peek = getattr(stream, 'peek', None)
+    return peek(n) if peek is not None else b''
+
+
+def compression(stream):
+    """Return the name of the module that can decompress the binary
+    ``stream``, judging by the magic bytes at its current position, or None
+    if it doesn't look compressed.
+
+    Nothing is consumed: regular files are checked directly, and other
+    streams need a ``peek`` method, like :class:`io.BufferedReader`'s."""
+    m = _MAGIC.match(_head(stream, 6))
+    return m and _MODULES[m.lastindex]
+
+
+class _BlockReader(io.RawIOBase):
+    def __init__(self, blocks):
+        self._blocks = iter(blocks)
+        self._block = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._block:
+            try:
+                self._block = memoryview(next(self._blocks))
+            except StopIteration:
+                return 0
+        n = min(len(b), len(self._block))
+        b[:n] = self._block[:n]
+        self._block = self._block[n:]
+        return n
+
+
+def open_decompressed(stream, threaded=False, block_size=1 << 16):
+    """If the binary ``stream`` is compressed with gzip, bzip2 or xz, return
+    a binary stream of its decompressed contents; otherwise return None.
+
+    With ``threaded``, the data is decompressed a block at a time in a
+    background thread (the decompressors release the GIL), so that it
+    overlaps with whatever is reading the result. Either way the returned
+    stream has no file descriptor, so it's never mistaken for a file that
+    can be memory-mapped.
+    """
+    name = compression(stream)
+    if name is None:
+        return None
+    f = import_module(name).open(stream)
+    blocks = iter(lambda: f.read1(block_size), b'')
+    if threaded:
+        blocks = ReadAhead(([block] for block in blocks), name=name)
+    return io.BufferedReader(_BlockReader(blocks), block_size)
+
+
+def _roundrobin(iterables):
+    nexts = [iter(it).__next__ for it in iterables]
+    while nexts:
+        live = []
+        for next_ in nexts:
+            try:
+                item = next_()
+            except StopIteration:
+                continue
+            live.append(next_)
+            yield item
+        nexts = live
+
+
+class Inputs:
+    """Iterate over the items of several inputs, keeping track of where the
+    last one came from, like :mod:`fileinput`.
+
+    Each of ``names`` is passed to ``open``, which returns an iterable of
+    the items in that input. They're combined according to ``mode``:
+    ``'concat'`` goes through the inputs one after another, opening each as
+    it's reached; ``'interleave'`` takes an item from each in turn; and
+    ``'merge-sorted'`` merges inputs that are each already sorted (by
+    ``key``, if it's given) into one sorted sequence, with a heap.
+
+    After each item, ``filename`` is the name of the input it came from,
+    ``filelineno`` its one-based number in that input and ``lineno`` its
+    one-based number overall.
+    """
+
+    modes = ('concat', 'interleave', 'merge-sorted')
+
+    def __init__(self, names, open, mode='concat', key=None):
+        if mode not in self.modes:
+            raise ValueError('unknown mode {!r}'.format(mode))
+        self.names = list(names)
+        self.mode = mode
+        self.key = key
+        self.filename = None
+        self.filelineno = 0
+        self._base = 0
+        self._open = open
+
+    def __repr__(self):
+        return '<Inputs {} {!r}>'.format(self.mode, self.names)
+
+    @property
+    def lineno(self):
+        return self._base + self.filelineno
+
+    def _numbered(self, name):
+        return zip(repeat(name), count(1), self._open(name))
+
+    def _concat(self):
+        for name in self.names:
+            self._base += self.filelineno
+            self.filelineno = 0
+            self.filename = name
+            for self.filelineno, item in enumerate(self._open(name), 1):
+                yield item
+
+    def __iter__(self):
+        if self.mode == 'concat':
+            return self._concat()
+        inputs = [self._numbered(name) for name in self.names]
+        if self.mode == 'interleave':
+            return self._track(_roundrobin(inputs))
+        if self.key is None:
+            return self._track(heapq.merge(*inputs, key=itemgetter(2)))
+        key = self.key
+        return self._track(heapq.merge(*inputs, key=lambda t: key(t[2])))
+
+    def _track(self, tagged):
+        for lineno, (name, n, item) in enumerate(tagged, 1):
+            self.filename = name
+            self.filelineno = n
+            self._base = lineno - n
+            yield item
+
+
+# from <sys/inotify.h>
+_IN_MODIFY = 0x2
+_IN_ATTRIB = 0x4
+_IN_MOVED_FROM = 0x40
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_CLOEXEC = 0o2000000
+_IN_NONBLOCK = 0o4000
+_IN_DIRECTORY_EVENTS = (_IN_MODIFY | _IN_ATTRIB | _IN_MOVED_FROM | _IN_MOVED_TO |
+                        _IN_CREATE | _IN_DELETE)
+
+
+class _Inotify:
+    """Wait for something to happen in the directory of ``path``, using
+    Linux's inotify through :mod:`ctypes`."""
+
+    def __init__(self, path):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        fd = libc.inotify_init1(_IN_CLOEXEC | _IN_NONBLOCK)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        directory = os.path.dirname(os.path.abspath(path))
+        if libc.inotify_add_watch(fd, os.fsencode(directory), _IN_DIRECTORY_EVENTS) < 0:
+            errno = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(errno, 'inotify_add_watch failed', directory)
+        self._fd = fd
+
+    def wait(self, timeout):
+        if select.select([self._fd], [], [], timeout)[0]:
+            try:
+                while os.read(self._fd, 1 << 12):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def close(self):
+        os.close(self._fd)
+
+
+class _Poller:
+    def __init__(self, interval=0.1):
+        self.interval = interval
+
+    def wait(self, timeout):
+        time.sleep(min(self.interval, timeout))
+
+    def close(self):
+        pass
+
+
+def _make_watcher(path):
+    try:
+        return _Inotify(path)
+    except (AttributeError, OSError, TypeError):
+        # not Linux, or out of watches
+        return _Poller()
+
+
+class _Follower:
+    # how long to wait before checking on the file anyway, in case a change
+    # happened that the watcher can't see
+    timeout = 1.0
+
+    def __init__(self, path, watcher, idle=None, from_start=False):
+        self.path = path
+        self.watcher = watcher
+        self.idle = idle
+        self.file = None
+        self._open(from_start)
+
+    def _open(self, from_start=True):
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+        if self.file is not None:
+            self.file.close()
+        self.file = f
+        self._id = self._identity(os.fstat(f.fileno()))
+        if not from_start:
+            f.seek(0, io.SEEK_END)
+
+    @staticmethod
+    def _identity(st):
+        return st.st_dev, st.st_ino
+
+    def _check(self):
+        """See whether the file was replaced or truncated since we reached
+        the end of it."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if self.file is None or self._identity(st) != self._id:
+            # rotated: whatever was left of the old file has been read
+            self._open()
+        elif st.st_size < self.file.tell():
+            self.file.seek(0)
+
+    def read(self, n):
+        while True:
+            if self.file is not None:
+                block = self.file.read(n)
+                if block:
+                    return block
+            self._check()
+            if self.file is not None:
+                block = self.file.read(n)
+                if block:
+                    return block
+            if self.idle is not None:
+                self.idle()
+            self.watcher.wait(self.timeout)
+
+
+def follow(path, binary=False, encoding=None, errors=None, idle=None,
+           block_size=1 << 16, watcher=None):
+    """Yield lists of the lines appended to the file at ``path``, one list
+    for each block read, forever, like ``tail -F``.
+
+    Lines are :class:`bytes` without their newlines if ``binary`` is true,
+    and otherwise decoded text including them, as from
+    :func:`read_line_batches` and :func:`read_text_batches`. Reading starts
+    at the current end of the file. If the file is replaced, as when logs
+    are rotated, the new one is read from its start; if it's truncated,
+    reading starts again from the beginning.
+
+    ``idle`` is called whenever there's nothing more to read, before
+    waiting for the file to change. By default the wait uses inotify where
+    it's available, and otherwise polls.
+    """
+    follower = _Follower(path, watcher or _make_watcher(path), idle)
+    if binary:
+        return _line_batches(follower.read, block_size, lambda b: b.split(b'\n'))
+    encoding = encoding or locale.getpreferredencoding(False)
+    decoder = codecs.getincrementaldecoder(encoding)(errors or 'strict')
+    decoder = io.IncrementalNewlineDecoder(decoder, translate=True)
+
+    def read_text(n):
+        while True:
+            text = decoder.decode(follower.read(n))
+            if text:
+                return text
+    return _line_batches(read_text, block_size, _split_text)
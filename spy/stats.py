@@ -0,0 +1,137 @@
+from time import perf_counter
+import random
+import sys
+
+from .core import chain, describe
+
+
+class StepStats:
+    """Counters and timings for a single step of a chain."""
+
+    max_samples = 10000
+
+    def __init__(self):
+        self.items_in = 0
+        self.items_out = 0
+        self.cumulative = 0.0
+        self.upstream = 0.0
+        self.samples = []
+        self._seen = 0
+        self._random = random.Random(0)
+
+    def add_sample(self, t):
+        # reservoir sampling keeps memory flat on long runs
+        self._seen += 1
+        if len(self.samples) < self.max_samples:
+            self.samples.append(t)
+        else:
+            i = self._random.randrange(self._seen)
+            if i < self.max_samples:
+                self.samples[i] = t
+
+    @property
+    def self_time(self):
+        return self.cumulative - self.upstream
+
+    def percentile(self, p):
+        if not self.samples:
+            return 0.0
+        s = sorted(self.samples)
+        return s[min(len(s) - 1, int(len(s) * p))]
+
+    def format(self):
+        bits = ['in {}'.format(self.items_in), 'out {}'.format(self.items_out)]
+        if self.items_in:
+            ratio = self.items_out / self.items_in
+            if ratio < 1:
+                bits[-1] += ' ({:.1%} dropped)'.format(1 - ratio)
+            elif ratio > 1:
+                bits[-1] += ' (x{:.2f})'.format(ratio)
+        bits.append('self {}'.format(_format_time(self.self_time)))
+        bits.append('cumulative {}'.format(_format_time(self.cumulative)))
+        if self.items_out:
+            bits.append('mean {}'.format(_format_time(self.self_time / self.items_out)))
+            bits.append('p99 {}'.format(_format_time(self.percentile(0.99))))
+        return ', '.join(bits)
+
+
+def _format_time(t):
+    if t >= 1:
+        return '{:.2f}s'.format(t)
+    if t >= 1e-3:
+        return '{:.2f}ms'.format(t * 1e3)
+    return '{:.2f}us'.format(t * 1e6)
+
+
+def instrument(step, stats):
+    """Wrap ``step`` so that items passing through it and time spent in it
+    are recorded in ``stats``."""
+    def instrumented(ita, index=None):
+        it = iter(ita)
+
+        def feed():
+            while True:
+                t = perf_counter()
+                try:
+                    x = next(it)
+                except StopIteration:
+                    stats.upstream += perf_counter() - t
+                    return
+                stats.upstream += perf_counter() - t
+                stats.items_in += 1
+                yield x
+
+        try:
+            out = iter(step(feed(), index=index))
+        except TypeError:
+            out = iter(step(feed()))
+        while True:
+            t = perf_counter()
+            upstream = stats.upstream
+            try:
+                x = next(out)
+            except StopIteration:
+                stats.cumulative += perf_counter() - t
+                return
+            dt = perf_counter() - t
+            stats.cumulative += dt
+            stats.add_sample(dt - (stats.upstream - upstream))
+            stats.items_out += 1
+            yield x
+    if hasattr(step, 'fragment_fn'):
+        instrumented.fragment_fn = step.fragment_fn
+    return instrumented
+
+
+class Profiler:
+    """Collect per-step statistics for a chain."""
+
+    def __init__(self):
+        self.steps = []
+        self.sources = []
+
+    def add_source(self, label, source):
+        """Report ``source.format()`` above the steps, as ``label``."""
+        self.sources.append((label, source))
+
+    def wrap(self, ch):
+        """Return a copy of the chain ``ch`` with each step instrumented."""
+        seq = []
+        for step in ch.seq:
+            stats = StepStats()
+            self.steps.append((step, stats))
+            seq.append(instrument(step, stats))
+        self._chain = chain(seq, index_offset=ch.index_offset)
+        return self._chain
+
+    def format(self):
+        l = []
+        for label, source in self.sources:
+            l.append('    | {}: {}'.format(label, source.format()))
+        for (i, _), (step, stats) in zip(self._chain.numbered(), self.steps):
+            l.append('{:3} | {}'.format(i, describe(step)))
+            l.append('    |   ' + stats.format())
+        return '\n'.join(l)
+
+    def report(self, file=None):
+        print(self.format(), file=file or sys.stderr)
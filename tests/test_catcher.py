@@ -75,3 +75,20 @@ def test_excepthook_forwards():
     except Exception:
         sys.excepthook(*sys.exc_info())
     assert ok[0]
+
+
+def test_function_fragment(capsys, monkeypatch):
+    import io
+    import spy.cli
+    monkeypatch.setattr(sys, 'stdin', io.StringIO('1\n0\n'))
+    try:
+        spy.cli._cli()(sys.argv[0], '-l', '[1 / int(x) for x in pipe]')
+    except catcher.CaughtException as e:
+        e.print_traceback()
+    out, err = capsys.readouterr()
+    assert err.splitlines()[1:] == [
+        '  Fragment 1',
+        '    [1 / int(x) for x in pipe]',
+        "    input to fragment was '0'",
+        'ZeroDivisionError: division by zero',
+    ]
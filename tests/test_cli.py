@@ -1,3 +1,4 @@
+import gzip
 import io
 import sys
 
@@ -33,6 +34,49 @@ def test_make_callable():
     assert ca('bar') == 'RAB'
 
 
+def test_make_function():
+    context = spy.cli.make_context()
+    context['k'] = 3
+    ca = spy.cli.make_function('x = pipe.upper(); pipe = x[::-1]', False,
+                               context, 'pipe', local_names={'x'})
+    assert ca('bar') == 'RAB'
+    assert 'x' not in context
+    ca = spy.cli.make_function('[c * k for c in pipe]', True, context, 'pipe')
+    assert ca('ab') == ['aaa', 'bbb']
+    ca = spy.cli.make_function('len == 2', True, context, 'pipe')
+    assert ca(None)('ab')
+    ca = spy.cli.make_function('list(spy.collect())', True, context, 'pipe')
+    assert list(spy.chain([spy.fragment(ca)]).apply([1, 2])) == [[1, 2]]
+
+
+def test_make_steps_mutable_names(capsys, monkeypatch):
+    monkeypatch.setattr(sys, 'stdin', io.StringIO('1\n2\n'))
+    argv = sys.argv[0:1] + [
+            '--no-exception-handling',
+            '-p', 'n = 0',
+            '-p', 'def inc(x):\n global n\n n += 1\n return x',
+            '-l', 'inc(pipe)', 'pipe + str(n)']
+    spy.cli._cli()(*argv)
+    out, err = capsys.readouterr()
+    assert out == '11\n22\n'
+
+
+def test_make_steps_carried_names(capsys, monkeypatch):
+    # a name read before it's assigned carries over from the previous item
+    monkeypatch.setattr(sys, 'stdin', io.StringIO('a\nb\nc\n'))
+    spy.cli._cli()(sys.argv[0], '--no-exception-handling', '-l',
+                   'try:\n    n += 1\nexcept NameError:\n    n = 1\npipe = n')
+    out, err = capsys.readouterr()
+    assert out == '1\n2\n3\n'
+
+    for step, local_names in [('x = pipe * 2; pipe = x + x', {'x'}),
+                              ('pipe = n = pipe + (n or "")', None),
+                              ('if pipe: y = 1\npipe = y', None)]:
+        parsed = spy.cli.parse_steps([step])
+        spy.cli._plan_steps(parsed, spy.cli.make_context(), 'pipe', ())
+        assert parsed[0].local_names == local_names
+
+
 def test_context_builtins():
     context = spy.cli.make_context()
     # inner scope won't have builtins unless context does
@@ -188,6 +232,180 @@ def test_raw(capsys, monkeypatch):
     assert out == input
 
 
+def test_forward_only(capsys, monkeypatch):
+    monkeypatch.setattr(sys, 'stdin', io.StringIO('a\nbb\nccc\n'))
+    spy.cli._cli()(sys.argv[0], '--forward-only', 'sum(len(l) for l in pipe)')
+    out, err = capsys.readouterr()
+    assert out == '6\n'
+
+
+@pytest.mark.parametrize('engine', ['chain', 'codegen'])
+def test_binary_filter(capsysbinary, monkeypatch, engine):
+    monkeypatch.setattr(sys, 'stdin', io.TextIOWrapper(io.BytesIO(b'foo\n\xffbar\nbaz')))
+    spy.cli._cli()(sys.argv[0], '--binary', '--engine', engine, '-l', '-f', 'b"a" in pipe', 'pipe.upper()')
+    out, err = capsysbinary.readouterr()
+    assert out == b'\xffBAR\nBAZ\n'
+
+    monkeypatch.setattr(sys, 'stdin', io.TextIOWrapper(io.BytesIO(b'foo\n\xffbar\nbaz')))
+    spy.cli._cli()(sys.argv[0], '--binary', '--engine', engine, 'pipe[-3:]', 'len(pipe)')
+    out, err = capsysbinary.readouterr()
+    assert out == b'3\n'
+
+
+@pytest.mark.parametrize('engine', ['chain', 'codegen'])
+def test_binary(capsysbinary, monkeypatch, engine):
+    stdin = io.TextIOWrapper(io.BytesIO(b'ab\xff\ncd\n'))
+    monkeypatch.setattr(sys, 'stdin', stdin)
+    spy.cli._cli()(sys.argv[0], '--binary', '--engine', engine, '-l', 'pipe[::-1]')
+    assert capsysbinary.readouterr().out == b'\xffba\ndc\n'
+
+    stdin = io.TextIOWrapper(io.BytesIO(b'ab\xff\ncd\n'))
+    monkeypatch.setattr(sys, 'stdin', stdin)
+    spy.cli._cli()(sys.argv[0], '--binary', '--engine', engine,
+                   'pipe.nbytes', '[pipe, None, str(pipe)]', '-m', 'pipe')
+    assert capsysbinary.readouterr().out == b'7\n7\n'
+
+
+def test_read_ahead(capsys, monkeypatch):
+    monkeypatch.setattr(sys, 'stdin', io.StringIO('a\nbb\nccc\n'))
+    spy.cli._cli()(sys.argv[0], '--read-ahead=2', '-l', 'len(pipe)')
+    out, err = capsys.readouterr()
+    assert out == '1\n2\n3\n'
+    monkeypatch.setattr(sys, 'stdin', io.StringIO('a\nbb\nccc\n'))
+    spy.cli._cli()(sys.argv[0], '--read-ahead=2', '--profile', 'pipe[1]')
+    out, err = capsys.readouterr()
+    assert out == 'bb\n'
+    assert err.startswith('    | read-ahead: queue size 2')
+
+
+def test_output_buffer(capsys, monkeypatch):
+    monkeypatch.setattr(sys, 'stdin', io.StringIO('a\nb\n'))
+    spy.cli._cli()(sys.argv[0], '--output-buffer=0', '-l', 'print(pipe) or pipe.upper()')
+    out, err = capsys.readouterr()
+    assert out == 'a\nA\nb\nB\n'
+
+
+@pytest.mark.parametrize('decompress', ['auto', 'thread'])
+def test_decompress(capsys, monkeypatch, decompress):
+    data = gzip.compress(b'a\nb\n') + gzip.compress(b'c\n')
+    monkeypatch.setattr(sys, 'stdin', io.TextIOWrapper(io.BufferedReader(io.BytesIO(data))))
+    spy.cli._cli()(sys.argv[0], '--decompress', decompress, '-l', 'pipe.upper()')
+    out, err = capsys.readouterr()
+    assert out == 'A\nB\nC\n'
+
+
+def test_decompress_off(capsysbinary, monkeypatch):
+    data = gzip.compress(b'a\n')
+    monkeypatch.setattr(sys, 'stdin', io.TextIOWrapper(io.BufferedReader(io.BytesIO(data))))
+    spy.cli._cli()(sys.argv[0], '--decompress', 'off', '--binary', 'pipe[:2]')
+    assert capsysbinary.readouterr().out == b'\x1f\x8b\n'
+
+
+def test_files(capsys, monkeypatch, tmp_path):
+    (tmp_path / 'a').write_text('1 a\n3 c\n')
+    (tmp_path / 'b.gz').write_bytes(gzip.compress(b'2 b\n4 d\n'))
+    files = ['--file', str(tmp_path / 'a'), '--file', str(tmp_path / 'b.gz')]
+    monkeypatch.setattr(sys, 'stdin', io.StringIO('unused\n'))
+
+    spy.cli._cli()(sys.argv[0], *files, 'len(pipe)')
+    assert capsys.readouterr().out == '4\n'
+
+    spy.cli._cli()(sys.argv[0], *files, '--combine=merge-sorted', '-l',
+                   '"{} {}:{} {}".format(pipe, os.path.basename(spy.inputs.filename), '
+                   'spy.inputs.filelineno, spy.inputs.lineno)')
+    assert capsys.readouterr().out == '1 a a:1 1\n2 b b.gz:1 2\n3 c a:2 3\n4 d b.gz:2 4\n'
+
+
+def test_files_merge_key(capsys, monkeypatch, tmp_path):
+    (tmp_path / 'a').write_text('1\n3\n20\n')
+    (tmp_path / 'b').write_text('2\n10\n')
+    files = ['--file', str(tmp_path / 'a'), '--file', str(tmp_path / 'b')]
+    spy.cli._cli()(sys.argv[0], *files, '--combine=merge-sorted', '--merge-key=int(pipe)', '-l', 'pipe')
+    assert capsys.readouterr().out == '1\n2\n3\n10\n20\n'
+    spy.cli._cli()(sys.argv[0], *files, '--combine=interleave', '--binary', '-l', 'pipe')
+    assert capsys.readouterr().out == '1\n2\n3\n10\n20\n'
+
+
+
+def test_follow(capsys, monkeypatch, tmp_path):
+    path = tmp_path / 'log'
+    path.write_text('old\n')
+
+    class Watcher:
+        def wait(self, timeout):
+            with open(str(path), 'a') as f:
+                f.write('a\nb\n')
+    monkeypatch.setattr(spy.readers, '_make_watcher', lambda path: Watcher())
+    spy.cli._cli()(sys.argv[0], '--follow', str(path), '-e', '3', 'pipe.upper()')
+    assert capsys.readouterr().out == 'A\nB\nA\n'
+
+
+def test_format(capsys, monkeypatch):
+    monkeypatch.setattr(sys, 'stdin', io.StringIO('ab\ncd\n'))
+    spy.cli._cli()(sys.argv[0], '-l', '-i', '{pipe}-{1}{0!r}', '-i', '{pipe:>8}')
+    assert capsys.readouterr().out == " ab-b'a'\n cd-d'c'\n"
+
+
+@pytest.mark.parametrize('pattern', [r'foo (\d)', r'(?!x)foo (\d)'])
+def test_regex(capsysbinary, monkeypatch, pattern):
+    monkeypatch.setattr(sys, 'stdin', io.StringIO('foo 1\nbar\nfoo 2\n'))
+    spy.cli._cli()(sys.argv[0], '-l', '-R', pattern, 'pipe and pipe.group(1)')
+    assert capsysbinary.readouterr().out == b'1\n2\n'
+
+    monkeypatch.setattr(sys, 'stdin', io.TextIOWrapper(io.BytesIO(b'foo 1\nbar\nfoo 2')))
+    spy.cli._cli()(sys.argv[0], '-l', '--binary', '-R', 'foo', '-f', 'pipe', 'pipe.string')
+    assert capsysbinary.readouterr().out == b'foo 1\nfoo 2\n'
+
+
+
+@pytest.mark.parametrize('engine', ['chain', 'codegen'])
+def test_filter_pushdown(capsysbinary, monkeypatch, engine):
+    data = b'foo 1\nbar\r\nfoo 2\nbaz\n'
+    for args, expected in [(['-f', '"foo" in pipe', 'pipe[-1]'], b'1\n2\n'),
+                           (['-fR', 'ba', 'pipe.upper()'], b'BAR\nBAZ\n'),
+                           (['-f', '-R', r'\w+ \d', 'len(pipe)'], b'5\n5\n'),
+                           (['--binary', '-f', 'b"ar" in pipe'], b'bar\r\n'),
+                           (['-f', '"o\\n" in pipe'], b''),
+                           (['-f', '"a" not in pipe'], b'foo 1\nfoo 2\n')]:
+        monkeypatch.setattr(sys, 'stdin', io.TextIOWrapper(io.BytesIO(data)))
+        spy.cli._cli()(sys.argv[0], '-l', '--engine', engine, *args)
+        assert capsysbinary.readouterr().out == expected
+
+
+def test_scanner():
+    from spy.cli import _Decorated, _LiteralDecorated
+    from spy.decorators import filter, keywords, regex
+
+    def scanner(step, binary=False):
+        return spy.cli._scanner(spy.cli.parse_steps([step]), 'pipe', binary, io.StringIO())
+
+    assert scanner(_Decorated([filter], '"x" in pipe', '-f'))
+    assert scanner(_LiteralDecorated([regex, filter], 'x', '-R'))
+    for step, binary in [(_Decorated([filter], 'b"x" in pipe', '-f'), False),
+                         (_Decorated([filter], '"x" in pipe', '-f'), True),
+                         (_Decorated([filter], '"x" in other', '-f'), False),
+                         (_Decorated([filter], '"x" in pipe in pipe', '-f'), False),
+                         (_Decorated([filter], 'pipe = 1', '-f'), False),
+                         (_Decorated([keywords, filter], '"x" in pipe', '-f'), False),
+                         (_LiteralDecorated([regex, filter], '(?s)x', '-R'), False),
+                         ('"x" in pipe', False)]:
+        assert scanner(step, binary) is None
+
+
+def test_field_hint():
+    parsed = spy.cli.parse_steps(['pipe[2] == "x"', 'itemgetter(1, 5)(pipe)',
+                                  'pipe[-1]', 'other[9]'])
+    assert spy.cli._field_hint(parsed, 'pipe') == 5
+
+
+@pytest.mark.parametrize('engine', ['chain', 'codegen'])
+def test_fields(capsys, monkeypatch, engine):
+    monkeypatch.setattr(sys, 'stdin', io.StringIO('a\tb\tc\n1\t2\t3\n'))
+    spy.cli._cli()(sys.argv[0], '--fields=\\t', '--engine', engine, '-f', 'pipe[1] != "b"', 'pipe')
+    out, err = capsys.readouterr()
+    assert out == '1\t2\t3\n'
+
+
 def test_no_defaults(capsys, monkeypatch):
     monkeypatch.setattr(sys, 'stdin', io.StringIO(""))
     monkeypatch.setattr(sys, 'argv',
@@ -366,3 +584,124 @@ def test_dec_args(capsys, monkeypatch):
     out, err = capsys.readouterr()
     assert out == 'abc!xyz\n'
     assert not err
+
+
+def test_processes(capsys, monkeypatch):
+    monkeypatch.setattr(sys, 'stdin', io.StringIO('\n'.join(map(str, range(2000)))))
+    argv = sys.argv[0:1] + [
+            '--no-exception-handling', '--processes', '3',
+            '-p', 'k = 3',
+            '-l', '-c', 'int', '-f', 'pipe % k', '-m', '[pipe, -pipe]']
+    spy.cli._cli()(*argv)
+    out, err = capsys.readouterr()
+    expected = []
+    for i in range(2000):
+        if i % 3:
+            expected += [str(i), str(-i)]
+    assert out.split() == expected
+    assert not err
+
+
+def test_processes_fallback(capsys, monkeypatch):
+    monkeypatch.setattr(sys, 'stdin', io.StringIO('1\n2\n3\n'))
+    argv = sys.argv[0:1] + [
+            '--no-exception-handling', '--processes', '2',
+            '-l', '-c', 'int', '-a', 'sum(pipe)']
+    spy.cli._cli()(*argv)
+    out, err = capsys.readouterr()
+    assert out == '6\n'
+    assert 'fragment 2 needs the whole stream' in err
+
+    monkeypatch.setattr(sys, 'stdin', io.StringIO('1\n2\n3\n'))
+    spy.cli._cli()(sys.argv[0], '--processes', '2', 'len(pipe)')
+    out, err = capsys.readouterr()
+    assert out == '3\n'
+    assert '--processes needs --each-line' in err
+
+
+def test_processes_exception(capsys, monkeypatch):
+    monkeypatch.setattr(sys, 'stdin', io.StringIO('1\n2\n3\n'))
+    try:
+        spy.cli._cli()(sys.argv[0], '--processes', '2', '-l', '1 / (int(pipe) - 2)')
+        pytest.fail("didn't raise an exception")
+    except Exception:
+        sys.excepthook(*sys.exc_info())
+    out, err = capsys.readouterr()
+    assert "  Fragment 1" in err.splitlines()
+    assert "    input to fragment was '2'" in err.splitlines()
+
+
+def test_threads(capsys, monkeypatch):
+    monkeypatch.setattr(sys, 'stdin', io.StringIO('1\n2\n3\n4\n'))
+    argv = sys.argv[0:1] + [
+            '--no-exception-handling', '--threads', '3',
+            '-l', '-c', 'int', '-f', 'pipe % 2', '-a', 'sum(pipe)']
+    spy.cli._cli()(*argv)
+    out, err = capsys.readouterr()
+    assert out == '4\n'
+    assert not err
+
+    monkeypatch.setattr(sys, 'stdin', io.StringIO(''))
+    argv = sys.argv[0:1] + [
+            '--no-exception-handling', '--threads', '4',
+            '-m', '[{"a": 1}, {"a": 2}, {"a": 3}]', '-k', 'a * 10']
+    spy.cli._cli()(*argv)
+    out, err = capsys.readouterr()
+    assert out == '10\n20\n30\n'
+
+
+def test_concurrency(capsys, monkeypatch):
+    monkeypatch.setattr(sys, 'stdin', io.StringIO('3\n1\n2\n'))
+    argv = sys.argv[0:1] + [
+            '--no-exception-handling', '--concurrency', '3',
+            '-l', '-c', 'int', 'asyncio.sleep(pipe / 100, pipe)']
+    spy.cli._cli()(*argv)
+    out, err = capsys.readouterr()
+    assert out == '3\n1\n2\n'
+
+    monkeypatch.setattr(sys, 'stdin', io.StringIO('3\n1\n2\n'))
+    spy.cli._cli()(*argv[:2] + ['--unordered'] + argv[2:])
+    out, err = capsys.readouterr()
+    assert out == '1\n2\n3\n'
+
+
+@pytest.mark.parametrize('engine', ['auto', 'chain'])
+def test_coroutine_without_concurrency(capsys, monkeypatch, engine):
+    monkeypatch.setattr(sys, 'stdin', io.StringIO('a\nb\n'))
+    spy.cli._cli()(sys.argv[0], '--no-exception-handling', '--engine', engine,
+                   '-p', 'async def f(x): return x * 2', '-l', '-c', 'f', 'pipe.upper()')
+    out, err = capsys.readouterr()
+    assert out == 'AA\nBB\n'
+
+
+def test_engine(capsys, monkeypatch):
+    argv = ['-l', '-s', '1', '-e', '6', '-c', 'int', '-f', 'pipe % 2',
+            '-m', 'range(pipe)', '-t', '10 // pipe']
+    outputs = []
+    for engine in 'chain', 'codegen':
+        monkeypatch.setattr(sys, 'stdin', io.StringIO('1\n2\n3\n4\n5\n'))
+        spy.cli._cli()(sys.argv[0], '--engine', engine, *argv)
+        out, err = capsys.readouterr()
+        assert not err
+        outputs.append(out)
+    assert outputs[0] == outputs[1] == '5\n10\n5\n3\n2\n'
+
+    monkeypatch.setattr(sys, 'stdin', io.StringIO(''))
+    spy.cli._cli()(sys.argv[0], '--show-fragments', *argv)
+    out, err = capsys.readouterr()
+    assert 'def _spy_pipeline(_spy_ita):' in out
+
+    monkeypatch.setattr(sys, 'stdin', io.StringIO(''))
+    spy.cli._cli()(sys.argv[0], '--engine', 'codegen', '-a', 'list(pipe)')
+    out, err = capsys.readouterr()
+    assert "can't generate code" in err
+
+
+def test_profile(capsys, monkeypatch):
+    monkeypatch.setattr(sys, 'stdin', io.StringIO('1\n2\n3\n'))
+    spy.cli._cli()(sys.argv[0], '--profile', '-l', '-f', 'pipe != "2"')
+    out, err = capsys.readouterr()
+    assert out == '1\n3\n'
+    lines = err.splitlines()
+    assert lines[2] == "  1 | --filter 'pipe != \"2\"'"
+    assert 'in 3, out 2 (33.3% dropped)' in lines[3]
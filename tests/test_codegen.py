@@ -0,0 +1,39 @@
+import spy
+from spy import codegen, decorators
+from spy.cli import make_context
+
+
+def _pipeline(steps, **kw):
+    context = make_context()
+    steps = [(src, funcseq, ('Fragment {}'.format(i), src), loads)
+             for i, (src, funcseq, loads) in enumerate(steps, 1)]
+    return codegen.make_pipeline(steps, context, 'pipe', **kw)
+
+
+def test_pipeline(capsys):
+    fn, source = _pipeline([
+        ('pipe + 1', (), {'pipe'}),
+        ('pipe % 3', (decorators.filter,), {'pipe'}),
+        ('range', (decorators.callable, decorators.many), {'range'}),
+        ('10 // pipe', (decorators.try_except,), {'pipe'}),
+    ], start=1, end=4)
+    fn(range(10))
+    assert capsys.readouterr()[0] == '10\n5\n3\n'
+    assert source.count('for pipe in') == 2
+
+
+def test_ineligible():
+    assert _pipeline([('spy.DROP', (), {'spy'})]) is None
+    assert _pipeline([('pipe', (decorators.accumulate,), {'pipe'})]) is None
+    assert _pipeline([('pipe', (decorators.try_except, decorators.filter), {'pipe'})]) is None
+    assert _pipeline([('pipe', (), {'pipe'})], end=0) is None
+
+
+def test_prelude_function():
+    context = make_context()
+    context['f'] = lambda x: spy.DROP
+    context['n'] = 3
+    steps = [('f(pipe)', (), ('Fragment 1', 'f(pipe)'), {'f', 'pipe'})]
+    assert codegen.make_pipeline(steps, context, 'pipe') is None
+    steps = [('pipe + n', (), ('Fragment 1', 'pipe + n'), {'n', 'pipe'})]
+    assert codegen.make_pipeline(steps, context, 'pipe') is not None
@@ -132,3 +132,65 @@ def test_drop():
 def test_drop_has_repr():
     assert repr(spy.DROP) != object.__repr__(spy.DROP)
     assert 'DROP' in repr(spy.DROP)
+
+
+def test_threaded_fragment():
+    import threading
+    import time
+    barrier = threading.Barrier(3)
+
+    def slow(v):
+        if v < 3:
+            barrier.wait(timeout=5)
+        time.sleep(0.01 * (v % 2))
+        if v == 4:
+            return spy.DROP
+        if v == 5:
+            return spy.many([v, v])
+        return v * 2
+
+    chain = spy.chain([spy.threaded_fragment(slow, 3)])
+    assert list(chain.apply(range(7))) == [0, 2, 4, 6, 5, 5, 12]
+
+
+def test_threaded_fragment_context():
+    def with_context(v, context):
+        return list(spy.collect(context))
+
+    chain = spy.chain.auto_fragments([with_context], threads=2)
+    assert list(chain.apply([1, 2])) == [[1], [2]]
+
+
+def test_threaded_fragment_stops():
+    ita = iter(range(100))
+    f = spy.threaded_fragment(lambda v: v, 2)(ita)
+    assert next(f) == 0
+    f.close()
+    assert next(ita) <= 10
+
+
+def test_async_fragment():
+    import asyncio
+
+    async def delayed(v):
+        await asyncio.sleep(0.01 * (3 - v))
+        if v == 1:
+            return spy.DROP
+        return v
+
+    chain = spy.chain.auto_fragments([delayed], concurrency=3)
+    assert list(chain.apply(range(4))) == [0, 2, 3]
+    chain = spy.chain.auto_fragments([delayed], concurrency=3, ordered=False)
+    assert list(chain.apply(range(3))) == [2, 0]
+
+
+def test_async_fragment_awaitable_result():
+    import asyncio
+
+    def returns_awaitable(v, context):
+        return asyncio.sleep(0, spy.many([v] * v))
+
+    f = spy.async_fragment(returns_awaitable, 2)
+    assert list(spy.chain([f]).apply([1, 2])) == [1, 2, 2]
+    f = spy.async_fragment(lambda v: v + 1)
+    assert list(spy.chain([f]).apply([1, 2])) == [2, 3]
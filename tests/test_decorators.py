@@ -1,3 +1,5 @@
+from collections import namedtuple
+
 import clize.errors
 import lenses
 import pytest
@@ -101,6 +103,28 @@ def test_format():
     assert list(l) == ['123']
 
 
+@pytest.mark.parametrize('template', [
+    '', 'plain {{braces}}', '{0}-{1}', '{}{}', '{pipe}', '{pipe!r:>8}|{0!s:^5}|{1!a}',
+    '{name}', '{0.real}', '{name[key]}', '{name[0]:x}', '{0:{1}}', '{0}{}',
+])
+def test_compile_format(template):
+    import string
+    v = (10, 'é')
+    env = {'pipe': v, 'name': {'key': 'value', 0: 255}}
+    compiled = decorators._compile_format(template, 'pipe')
+    try:
+        expected = string.Formatter().vformat(template, v, env)
+    except ValueError:
+        assert compiled is None
+        return
+    if compiled is None:
+        assert '{1}}' in template
+        return
+    render, uses_env = compiled
+    assert uses_env == ('name' in template)
+    assert render(v, env, template) == expected
+
+
 def test_regex():
     @spy.fragment
     @decorators.regex
@@ -112,6 +136,17 @@ def test_regex():
     assert l[0].group(1) == '2'
 
 
+def test_regex_literal():
+    def test(v):
+        return {}, x
+    x = '1(2)3'
+    test._spy_literal = x
+    step = spy.fragment(decorators.regex(test))
+    x = 'changed'
+    l = list(spy.chain([step]).apply(['123', '456']))
+    assert l[0].group(1) == '2' and l[1] is None
+
+
 def test_keywords():
     # keywords only works with base functions that have _spy_setenv, so pure
     # python API won't work
@@ -136,8 +171,8 @@ def test_keywords():
 
 def test_convert_focus():
     assert decorators._convert_focus('_.Each()[2]') == lenses.lens.Each()[2]
-    assert decorators._convert_focus('1::2') == lenses.lens[1::2]
-    assert decorators._convert_focus('1:-1') == lenses.lens[1:-1]
+    assert decorators._convert_focus('1::2') == slice(1, None, 2)
+    assert decorators._convert_focus('1:-1') == slice(1, -1)
     assert decorators._convert_focus('1:2:3:4') == '1:2:3:4'
     assert decorators._convert_focus('1:abc') == '1:abc'
     assert decorators._convert_focus('1') == 1
@@ -168,6 +203,59 @@ def test_focus_without_lenses(monkeypatch):
     test_focus()
 
 
+@pytest.mark.parametrize('focus', [1, -1, 'a', slice(1, None, 2), slice(-2, None), slice(5, 9)])
+def test_focus_compiled(focus):
+    # the compiled accessors behave like the lenses they stand in for
+    lens = lenses.lens[focus]
+    if isinstance(focus, slice):
+        lens = lens.Each()
+    Point = namedtuple('Point', 'x y z')
+    f = lambda x: x * 2
+    for v in [[1, 2, 3, 4], (1, 2, 3), Point(1, 2, 3), 'abc', b'abc', {'a': 1, 1: 2}]:
+        for prep, expected in [(decorators._focus_prep, lambda: lens.modify(f)(v)),
+                               (decorators._magnify_prep, lambda: f(lens.get()(v)))]:
+            try:
+                result = expected()
+            except Exception as e:
+                with pytest.raises(type(e)):
+                    prep(None, focus)(f, v)
+            else:
+                got = prep(None, focus)(f, v)
+                assert got == result and type(got) is type(result)
+
+
+def test_focus_tuple(monkeypatch):
+    monkeypatch.setattr(decorators, 'lenses', None)
+    Point = namedtuple('Point', 'x y z')
+
+    @spy.fragment
+    @decorators.focus(-1)
+    def test(v):
+        return v * 3
+    l = list(spy.chain([test]).apply([(1, 2, 3), Point(4, 5, 6)]))
+    assert l == [(1, 2, 9), Point(4, 5, 18)]
+    assert type(l[1]) is Point
+
+
+def test_focus_in_place():
+    @spy.fragment
+    @decorators.focus_in_place(1)
+    def test(v):
+        return v * 3
+    items = [[1, 2, 3], {1: 'a'}, (4, 5, 6)]
+    l = list(spy.chain([test]).apply(items))
+    assert l == [[1, 6, 3], {1: 'aaa'}, (4, 15, 6)]
+    assert l[0] is items[0] and l[1] is items[1]
+
+    @spy.fragment
+    @decorators.focus_in_place(lenses.lens[1::2].Each())
+    def test(v):
+        return v * 3
+    items = [[1, 2, 3, 4]]
+    assert list(spy.chain([test]).apply(items)) == [[1, 6, 3, 12]]
+    assert items == [[1, 2, 3, 4]]
+
+
 def test_focus_lens():
     @spy.fragment
     @decorators.focus(lenses.lens[1::2].Each())
@@ -0,0 +1,136 @@
+import dataclasses
+import datetime
+import enum
+import io
+import sys
+import uuid
+
+import pytest
+
+import spy.cli
+from spy import formats
+
+
+@pytest.fixture(params=['orjson', 'json'])
+def jsonl(request, monkeypatch):
+    if request.param == 'json':
+        monkeypatch.setattr(formats, '_get_orjson', lambda: None)
+    elif formats._get_orjson() is None:
+        pytest.skip('orjson is not installed')
+    return formats.make_encoder('jsonl')
+
+
+def _text(s):
+    return s.decode('utf-8') if isinstance(s, bytes) else s
+
+
+def test_jsonl(jsonl):
+    encode, binary = jsonl
+    assert _text(encode({'a': [1, 'é'], 'b': None})) == '{"a":[1,"é"],"b":null}'
+    assert _text(encode(x for x in (1, 2))) == '[1,2]'
+    assert _text(encode(2 ** 70)) == str(2 ** 70)
+    assert encode(None) is None
+    with pytest.raises(TypeError):
+        encode(object())
+
+
+@pytest.mark.parametrize('thing', [
+    [1e16, 1e-7, 0.5, float('nan'), float('inf')],
+    {'a': (True, 2.0)}, {1: 'a'}, 'é', [2 ** 64],
+    datetime.date(2020, 1, 2), enum.Enum('E', 'a').a, uuid.UUID(int=0),
+    dataclasses.make_dataclass('D', ['x'])(1), {'s': {1}}])
+def test_jsonl_same_output(thing, monkeypatch):
+    # orjson is only a speedup: the output is the same without it
+    def encode():
+        try:
+            return _text(formats._json_encoder()[0](thing))
+        except TypeError:
+            return TypeError
+    expected = encode()
+    monkeypatch.setattr(formats, '_get_orjson', lambda: None)
+    assert encode() == expected
+
+
+def test_csv():
+    encode, binary = formats.make_encoder('csv')
+    assert not binary
+    assert encode({'a': 1, 'b': 'x,y'}) == 'a,b\n1,"x,y"'
+    assert encode({'b': 2}) == ',2'
+    with pytest.raises(ValueError, match="'c'"):
+        encode({'b': 2, 'c': 3})
+    assert encode(['a', 'b']) == 'a,b'
+    assert encode('a b') == 'a b'
+    assert encode(None) is None
+
+
+def test_tsv():
+    encode, binary = formats.make_encoder('tsv')
+    assert encode((1, 'a b', None)) == '1\ta b\t'
+
+
+def test_repr():
+    encode, binary = formats.make_encoder('repr')
+    assert encode('a') == "'a'"
+    assert encode(None) == 'None'
+
+
+def test_cli(capsysbinary, monkeypatch):
+    monkeypatch.setattr(sys, 'stdin', io.StringIO('1\n2\n'))
+    spy.cli._cli()(sys.argv[0], '--output=jsonl', '-l', '{"n": int(pipe)}')
+    out, err = capsysbinary.readouterr()
+    assert out == b'{"n":1}\n{"n":2}\n'
+
+
+def test_decode_jsonl(jsonl):
+    batches = [[b'{"a": 1}\n', b'\n'], ['[2]', ' 3 ']]
+    assert list(formats.decode('jsonl', batches)) == [[{'a': 1}], [[2], 3]]
+
+
+def test_decode_jsonl_error(jsonl):
+    decoded = formats.decode('jsonl', [['1', '2'], ['3', '{', '5']])
+    assert next(decoded) == [1, 2]
+    assert next(decoded) == [3]
+    with pytest.raises(ValueError):
+        next(decoded)
+
+
+def test_decode_csv():
+    batches = [['a,b\n', '1,"x\n'], ['y"\n', '3,4\n'], ['5,6']]
+    # the quoted newline carries the first record over into the second batch
+    assert list(formats.decode('csv', batches)) == [
+        [('a', 'b'), ('1', 'x\ny'), ('3', '4')], [('5', '6')]]
+    assert list(formats.decode('tsv', [['a\tb c\n']])) == [[('a', 'b c')]]
+
+
+@pytest.mark.parametrize('args', [[], ['--read-ahead=2']])
+def test_cli_input(capsys, monkeypatch, args):
+    monkeypatch.setattr(sys, 'stdin', io.StringIO('{"a": 1}\n{"a": 2}\n'))
+    spy.cli._cli()(sys.argv[0], '--input=jsonl', *args, 'pipe["a"] * 2')
+    out, err = capsys.readouterr()
+    assert out == '2\n4\n'
+
+    monkeypatch.setattr(sys, 'stdin', io.StringIO('{"a": 1}\n\n{"a": 2\n'))
+    with pytest.raises(Exception) as excinfo:
+        spy.cli._cli()(sys.argv[0], '--input=jsonl', *args, 'pipe["a"] * 2')
+    sys.excepthook(excinfo.type, excinfo.value, excinfo.tb)
+    out, err = capsys.readouterr()
+    assert out == '2\n'
+    assert err.splitlines()[:3] == [
+        'Traceback (most recent call last):',
+        '  Input line 3 (jsonl)',
+        '    {"a": 2',
+    ]
+
+
+def test_cli_input_csv_error(capsys, monkeypatch):
+    monkeypatch.setattr(sys, 'stdin', io.StringIO('a,b\nc,dddddd\n'))
+    limit = formats.csv.field_size_limit(3)
+    try:
+        with pytest.raises(Exception) as excinfo:
+            spy.cli._cli()(sys.argv[0], '--input=csv', 'pipe')
+        sys.excepthook(excinfo.type, excinfo.value, excinfo.tb)
+    finally:
+        formats.csv.field_size_limit(limit)
+    out, err = capsys.readouterr()
+    assert out == "('a', 'b')\n"
+    assert err.splitlines()[1] == '  Input line 2 (csv)'
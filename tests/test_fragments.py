@@ -36,6 +36,49 @@ class TestPrint:
         assert capsys.readouterr()[0] == 'this is a test\n'
 
 
+class TestWriter:
+    def test_buffer(self):
+        out = StringIO()
+        w = spy.fragments.Writer(out, buffer_size=10)
+        w.write('abc')
+        w.write(None)
+        w.write(12)
+        assert out.getvalue() == ''
+        w.write([1, 2])
+        assert out.getvalue() == 'abc\n12\n[1, 2]\n'
+        w.write(x for x in 'abcdefg')
+        w.flush()
+        assert out.getvalue().endswith("<iterable ['a', 'b', 'c', 'd', 'e', ...]>\n")
+
+    def test_line_buffered(self):
+        out = StringIO()
+        w = spy.fragments.Writer(out, line_buffered=True)
+        w.write('abc')
+        assert out.getvalue() == 'abc\n'
+
+    def test_displayhook(self, monkeypatch):
+        import builtins
+        out = StringIO()
+        w = spy.fragments.Writer(out, buffer_size=0)
+        w.write(3)
+        assert builtins._ == 3
+        monkeypatch.setattr(sys, 'stdout', out)
+        monkeypatch.setattr(sys, 'displayhook', lambda x: out.write('hook {}\n'.format(x)))
+        w.write(4)
+        assert out.getvalue() == '3\nhook 4\n'
+
+    def test_binary(self):
+        from io import BytesIO, TextIOWrapper
+        out = TextIOWrapper(BytesIO(), encoding='utf-8')
+        w = spy.fragments.Writer(out, binary=True)
+        w.write(b'\xff')
+        w.write(memoryview(b'abc'))
+        w.write('\u2603')
+        w.write(5)
+        w.flush()
+        assert out.buffer.getvalue() == b'\xff\nabc\n\xe2\x98\x83\n5\n'
+
+
 class TestLimit:
     def test_dots(self):
         f = spy.fragments.make_limit(end=0)([])
@@ -2,10 +2,11 @@ import pytest
 
 import builtins
 import io
+from itertools import islice
 from io import StringIO, UnsupportedOperation
 
 import spy, spy.core
-from spy.objects import Context, SpyFile, _ModuleProxy, _FunctionWrapper
+from spy.objects import Context, Fields, MappedSpyFile, SpyFile, _ModuleProxy, _FunctionWrapper, _WrapperCache, _wrap
 
 TEST_INPUT = '''this is a test input
 for use by a SpyFile
@@ -117,6 +118,20 @@ class TestFunctionWrapping:
         f = _FunctionWrapper(id)
         assert (-f)(7) == -7
 
+    def test_wrap_cache(self):
+        cache = _WrapperCache(2)
+        assert _wrap('foo', cache) == 'foo'
+        assert _wrap(ValueError, cache) is ValueError
+        assert _wrap([], cache) == []
+        assert not cache
+        w = _wrap(len, cache)
+        assert isinstance(w, _FunctionWrapper)
+        assert _wrap(len, cache) is w
+        _wrap(max, cache)
+        _wrap(len, cache)
+        _wrap(min, cache)
+        assert list(cache) == [len, min]
+
     def test_wrapper_repr(self):
         def f(x): pass
         assert repr(f) == repr(_FunctionWrapper(f))
@@ -146,9 +161,20 @@ class TestFunctionWrapping:
         assert (f + 2)(5) == 20
 
 
+@pytest.fixture(params=['stream', 'mapped'])
+def make_spyfile(request, tmp_path):
+    def make(text):
+        if request.param == 'stream':
+            return SpyFile(StringIO(text, newline=None))
+        path = tmp_path / 'input'
+        path.write_bytes(text.encode('utf-8'))
+        return MappedSpyFile(str(path))
+    return make
+
+
 @pytest.fixture
-def spyfile():
-    return SpyFile(StringIO(TEST_INPUT))
+def spyfile(make_spyfile):
+    return make_spyfile(TEST_INPUT)
 
 
 class TestSpyFile:
@@ -157,6 +183,37 @@ class TestSpyFile:
         assert spyfile.read(0) == ''
         assert spyfile.read() == TEST_INPUT[27:]
 
+    def test_read_all(self, spyfile):
+        assert spyfile.read(-1) == TEST_INPUT
+        assert spyfile.read() == ''
+        assert spyfile.readline() == ''
+        assert spyfile.seek(0, io.SEEK_CUR) == len(TEST_INPUT)
+        assert spyfile.seek(5) == 5
+        assert spyfile.read(4) == 'is a'
+        assert spyfile[-1] == 'it'
+
+    def test_negative_index(self, make_spyfile, monkeypatch):
+        monkeypatch.setattr(MappedSpyFile, 'chunk_size', 64)
+        f = make_spyfile(''.join('line {}\n'.format(i) for i in range(1000)))
+        assert f[-1] == 'line 999'
+        assert f[-1000] == 'line 0'
+        with pytest.raises(IndexError):
+            f[-1001]
+        assert f[-3:] == ['line 997', 'line 998', 'line 999']
+
+    def test_read_chunks(self, make_spyfile):
+        text = ''.join('line {}\n'.format(i) for i in range(1000))
+        f = make_spyfile(text)
+        assert f[0] == 'line 0'
+        chunks = iter(lambda: f.read(7), '')
+        assert ''.join(chunks) == text[:-1]
+
+    def test_readlines(self, spyfile):
+        spyfile.read(5)
+        assert spyfile.readlines() == [l + '\n' for l in TEST_INPUT[5:].splitlines()]
+        spyfile.seek(0)
+        assert spyfile.readlines(30) == ['this is a test input\n', 'for use by a SpyFile\n']
+
     def test_len(self, spyfile):
         assert len(spyfile) == len(TEST_INPUT.splitlines())
 
@@ -187,8 +244,8 @@ class TestSpyFile:
         with pytest.raises(UnsupportedOperation):
             spyfile.detach()
 
-    def test_positioning(self):
-        f = SpyFile(StringIO("foobar\n123456789\nhello\nasdfasdfasdfasdfcheese"))
+    def test_positioning(self, make_spyfile):
+        f = make_spyfile("foobar\n123456789\nhello\nasdfasdfasdfasdfcheese")
         assert f.read(3) == 'foo'
         assert f.readline() == 'bar\n'
         assert f.seek(10, io.SEEK_CUR) == 17
@@ -198,11 +255,11 @@ class TestSpyFile:
         assert f.seek(0) == 0
         assert f.readline() == 'foobar\n'
 
-        f = SpyFile(StringIO("foobar\n123456789\nhello\nasdfasdfasdfasdfcheese"))
+        f = make_spyfile("foobar\n123456789\nhello\nasdfasdfasdfasdfcheese")
         assert f.seek(17) == 17
         assert f.readline() == 'hello\n'
 
-        f = SpyFile(StringIO("foobar\n123456789\nhello\nasdfasdfasdfasdfcheese"))
+        f = make_spyfile("foobar\n123456789\nhello\nasdfasdfasdfasdfcheese")
         assert f.seek(-7, io.SEEK_END) == 39
         assert f.read() == 'cheese'
 
@@ -211,3 +268,101 @@ class TestSpyFile:
 
         assert f.seek(-1000) == 0
         assert f.seek(1000) == 46
+
+    def test_non_ascii(self, make_spyfile):
+        f = make_spyfile("caf\u00e9\r\nna\u00efve\n\u2603")
+        assert f[0] == 'caf\u00e9'
+        assert list(f) == ['caf\u00e9', 'na\u00efve', '\u2603']
+        assert f.seek(5) == 5
+        assert f.readline() == 'na\u00efve\n'
+        assert f.seek(-2, io.SEEK_END) == 11
+        assert f.read() == '\u2603'
+        assert str(f) == 'caf\u00e9\nna\u00efve\n\u2603'
+
+
+class TestForwardOnly:
+    def make(self):
+        f = SpyFile(StringIO(''.join('{}\n'.format(i) for i in range(100))), forward_only=True)
+        f._release_every = 10
+        return f
+
+    def test_release(self):
+        f = self.make()
+        assert sum(1 for _ in f) == 100
+        assert len(f.lines) < 20
+        with pytest.raises(UnsupportedOperation):
+            f[0]
+        with pytest.raises(UnsupportedOperation):
+            next(iter(f))
+
+    def test_readers(self):
+        f = self.make()
+        a, b = iter(f), iter(f)
+        assert list(islice(a, 50))[-1] == '49'
+        assert f._base == 0
+        assert list(zip(a, b))[-1] == ('99', '49')
+        assert f._base >= 40
+
+    def test_retain(self):
+        f = self.make()
+        assert f[3] == '3'
+        assert sum(1 for _ in f) == 100
+        assert len(f) == 100
+        assert f.readline() == '0\n'
+
+
+class TestMappedSpyFile:
+    def test_chunks(self, tmp_path):
+        lines = ['line {}'.format(i) * (i % 7) for i in range(5000)]
+        path = tmp_path / 'input'
+        path.write_text('\n'.join(lines) + '\n')
+        f = MappedSpyFile(str(path))
+        f.chunk_size = 100
+        assert f[4321] == lines[4321]
+        assert len(f) == len(lines)
+        assert list(f._line_iter()) == lines
+        assert f.read() == '\n'.join(lines)
+
+    def test_stream(self, tmp_path):
+        path = tmp_path / 'input'
+        path.write_bytes(b'skip\nfoo\nbar\n')
+        with open(str(path)) as stream:
+            stream.buffer.raw.seek(5)
+            f = MappedSpyFile(stream)
+            assert list(f) == ['foo', 'bar']
+            assert repr(f) == '<SpyFile stream={!r}>'.format(str(path))
+
+    def test_unmappable(self, tmp_path):
+        path = tmp_path / 'input'
+        path.write_bytes(b'')
+        with pytest.raises(ValueError):
+            MappedSpyFile(str(path))
+        path.write_bytes('foo'.encode('utf-16'))
+        with open(str(path), encoding='utf-16') as stream:
+            with pytest.raises(ValueError):
+                MappedSpyFile(stream)
+        with pytest.raises(UnsupportedOperation):
+            MappedSpyFile(StringIO('foo'))
+
+
+class TestFields:
+    def test_lazy(self):
+        f = Fields('a\tb\tc\td', '\t', maxsplit=1)
+        assert f._fields is None
+        assert f[1] == 'b'
+        assert f._fields == ['a', 'b', 'c\td']
+        assert f[2] == 'c'
+        assert f._fields == ['a', 'b', 'c', 'd']
+        with pytest.raises(IndexError):
+            f[4]
+
+    def test_sequence(self):
+        f = Fields('a b  c')
+        assert len(f) == 3
+        assert f[-1] == 'c'
+        assert f[:2] == ('a', 'b')
+        assert f == ('a', 'b', 'c')
+        assert hash(f) == hash(('a', 'b', 'c'))
+        assert repr(f) == "('a', 'b', 'c')"
+        assert str(f) == 'a b  c'
+        assert Fields(b'x,y', b',')[1] == b'y'
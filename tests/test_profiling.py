@@ -0,0 +1,83 @@
+import io
+import pstats
+import sys
+
+import spy.cli
+from spy import profiling
+
+
+def test_fragment_labels():
+    labels = profiling.fragment_labels([('Fragment 1', 'pipe;\n  1')])
+    assert labels == {'Fragment 1': 'Fragment 1: pipe: 1'}
+    assert profiling._relabel(('Fragment 1', 1, '<fragment>'), labels) == \
+        ('Fragment 1', 1, 'Fragment 1: pipe: 1')
+    assert profiling._relabel(('Fragment 1', 1, '<listcomp>'), labels)[2] == \
+        'Fragment 1: pipe: 1 <listcomp>'
+    assert profiling._relabel(('x.py', 3, 'f'), labels) == ('x.py', 3, 'f')
+    assert profiling._relabel((spy.decorators.__file__, 99, 'filter'), labels) == \
+        ('~', 0, 'decorator --filter')
+
+
+def test_sampler():
+    sampler = profiling.Sampler({})
+    sampler.sample(sys._getframe())
+    # not inside a chain
+    assert not sampler.counts
+
+
+def _run(monkeypatch, *args):
+    monkeypatch.setattr(sys, 'stdin', io.StringIO('\n'.join(map(str, range(20000)))))
+    spy.cli._cli()(sys.argv[0], *args)
+
+
+def test_cprofile(monkeypatch, capsys, tmp_path):
+    path = str(tmp_path / 'out.prof')
+    _run(monkeypatch, '--cprofile', path, '-l', '-c', 'int', 'pipe * 2')
+    assert capsys.readouterr().out.splitlines()[-1] == '39998'
+    st = pstats.Stats(path)
+    names = {funcname for _, _, funcname in st.stats}
+    assert "Fragment 2: pipe * 2" in names
+
+    _run(monkeypatch, '--cprofile', path, '-l', '-f', 'int(pipe) % 3', '-c', 'int', 'pipe * 2')
+    capsys.readouterr()
+    st = pstats.Stats(path)
+    names = {funcname for _, _, funcname in st.stats}
+    assert "Fragment 1: --filter 'int(pipe) % 3'" in names
+    assert 'decorator --filter' in names
+    for key, (_, _, _, _, callers) in st.stats.items():
+        for filename, _, _ in [key, *callers]:
+            assert filename not in profiling._INTERNAL_FILES
+
+
+def test_fold_stats():
+    internal = next(iter(profiling._INTERNAL_FILES))
+    main = ('main.py', 1, 'main')
+    wrapper = (internal, 10, 'wrapped')
+    other = ('other.py', 2, 'other')
+    stats = {
+        main: (1, 1, 1.0, 10.0, {}),
+        other: (1, 1, 1.0, 2.0, {}),
+        wrapper: (4, 4, 2.0, 8.0, {main: (3, 3, 1.5, 6.0), other: (1, 1, 0.5, 2.0)}),
+        ('Fragment 1', 1, '<fragment>'): (4, 4, 6.0, 6.0, {wrapper: (4, 4, 6.0, 6.0)}),
+        (internal, 20, 'run'): (1, 1, 0.5, 0.5, {}),
+    }
+    labels = profiling.fragment_labels([('Fragment 1', 'pipe')])
+    folded = profiling._fold_stats(stats, labels)
+    assert set(folded) == {main, other, ('Fragment 1', 1, 'Fragment 1: pipe'), profiling._ROOT}
+    assert folded[main][2] == 2.5 and folded[other][2] == 1.5
+    assert folded[('Fragment 1', 1, 'Fragment 1: pipe')][4] == {
+        main: (3, 3, 4.5, 4.5), other: (1, 1, 1.5, 1.5)}
+    assert folded[profiling._ROOT][2] == 0.5
+
+
+def test_flamegraph(monkeypatch, capsys, tmp_path):
+    path = tmp_path / 'out.txt'
+    _run(monkeypatch, '--flamegraph', str(path), '-l',
+         'sum(x * x for x in range(int(pipe) % 200))')
+    assert capsys.readouterr().out.splitlines()[2] == '1'
+    lines = path.read_text().splitlines()
+    assert any('Fragment 1: sum(' in line for line in lines)
+    for line in lines:
+        stack, count = line.rsplit(' ', 1)
+        assert stack.startswith('spy')
+        assert int(count) > 0
@@ -0,0 +1,204 @@
+import bz2
+import gzip
+import io
+import lzma
+import re
+
+import pytest
+
+from spy import readers
+
+
+def test_read_lines():
+    data = b'ab\xff\n\ncd\nlast'
+    assert list(readers.read_lines(io.BytesIO(data), block_size=3)) == \
+        [b'ab\xff', b'', b'cd', b'last']
+    assert list(readers.read_lines(io.BytesIO(b'x\n'))) == [b'x']
+    assert list(readers.read_lines(io.BytesIO(b''))) == []
+
+
+def test_read_buffer(tmp_path):
+    assert readers.read_buffer(io.BytesIO(b'abc')).tobytes() == b'abc'
+    path = tmp_path / 'input'
+    path.write_bytes(b'skip\nrest\n')
+    with open(str(path), 'rb') as f:
+        f.seek(5)
+        assert readers.read_buffer(f).tobytes() == b'rest\n'
+    path.write_bytes(b'')
+    with open(str(path), 'rb') as f:
+        assert readers.read_buffer(f).tobytes() == b''
+
+
+def test_read_text_batches():
+    data = 'café\r\nnaïve\n\n☃'.encode('utf-8')
+    stream = io.TextIOWrapper(io.BytesIO(data), encoding='utf-8')
+    batches = list(readers.read_text_batches(stream, block_size=2))
+    assert [l for b in batches for l in b] == ['café\n', 'naïve\n', '\n', '☃']
+    stream = io.StringIO('foo\nbar\n')
+    assert list(readers.read_text_batches(stream)) == [['foo\n', 'bar\n']]
+
+
+def test_read_ahead():
+    batches = ([i, i + 1] for i in range(0, 100, 2))
+    r = readers.ReadAhead(batches, size=2)
+    assert list(r) == list(range(100))
+    assert r.gets == 51
+    assert list(r) == []
+    assert 'queue size 2' in r.format()
+
+
+def test_read_ahead_error():
+    def batches():
+        yield ['a\n', 'b\n']
+        raise ValueError('oops')
+    r = readers.ReadAhead(batches())
+    it = iter(r)
+    assert next(it) == 'a\n'
+    assert next(it) == 'b\n'
+    with pytest.raises(ValueError):
+        next(it)
+
+
+@pytest.mark.parametrize('compress,name', [
+    (gzip.compress, 'gzip'), (bz2.compress, 'bz2'), (lzma.compress, 'lzma')])
+@pytest.mark.parametrize('threaded', [False, True])
+def test_open_decompressed(compress, name, threaded):
+    data = b''.join(b'line %d\n' % i for i in range(10000))
+    stream = io.BufferedReader(io.BytesIO(compress(data)))
+    assert readers.compression(stream) == name
+    f = readers.open_decompressed(stream, threaded=threaded, block_size=1000)
+    assert f.read() == data
+    with pytest.raises(io.UnsupportedOperation):
+        f.fileno()
+
+
+def test_not_compressed(tmp_path):
+    stream = io.BufferedReader(io.BytesIO(b'BZh? not bzip2'))
+    assert readers.compression(stream) is None
+    assert readers.open_decompressed(stream) is None
+    assert stream.read() == b'BZh? not bzip2'
+    path = tmp_path / 'input'
+    path.write_bytes(gzip.compress(b'abc'))
+    with open(str(path), 'rb') as f:
+        assert readers.compression(f) == 'gzip'
+        assert f.raw.tell() == 0
+
+
+def test_inputs():
+    data = {'a': [1, 4, 7], 'b': [2, 3, 9, 10], 'c': []}
+    opened = []
+
+    def open_(name):
+        opened.append(name)
+        return data[name]
+    inputs = readers.Inputs('abc', open_)
+    it = iter(inputs)
+    assert [next(it), next(it)] == [1, 4]
+    assert opened == ['a']
+    assert (inputs.filename, inputs.filelineno, inputs.lineno) == ('a', 2, 2)
+    assert list(it) == [7, 2, 3, 9, 10]
+    assert (inputs.filename, inputs.filelineno, inputs.lineno) == ('c', 0, 7)
+
+    inputs = readers.Inputs('abc', data.__getitem__, 'interleave')
+    assert [(x, inputs.filename, inputs.filelineno, inputs.lineno) for x in inputs] == [
+        (1, 'a', 1, 1), (2, 'b', 1, 2), (4, 'a', 2, 3), (3, 'b', 2, 4),
+        (7, 'a', 3, 5), (9, 'b', 3, 6), (10, 'b', 4, 7)]
+
+    inputs = readers.Inputs('abc', data.__getitem__, 'merge-sorted')
+    assert [(x, inputs.filename, inputs.lineno) for x in inputs] == [
+        (1, 'a', 1), (2, 'b', 2), (3, 'b', 3), (4, 'a', 4), (7, 'a', 5),
+        (9, 'b', 6), (10, 'b', 7)]
+    inputs = readers.Inputs('ab', {'a': [9, 2], 'b': [8, 1]}.__getitem__,
+                            'merge-sorted', key=lambda x: -x)
+    assert list(inputs) == [9, 8, 2, 1]
+
+    with pytest.raises(ValueError):
+        readers.Inputs('a', open_, 'shuffle')
+
+
+
+class _ScriptedWatcher:
+    """Run the next step of a script instead of waiting for the file."""
+
+    def __init__(self, *steps):
+        self.steps = list(steps)
+
+    def wait(self, timeout):
+        self.steps.pop(0)()
+
+
+def test_follow(tmp_path):
+    path = tmp_path / 'log'
+    rotated = tmp_path / 'log.1'
+    path.write_bytes(b'before\n')
+
+    def append(data, to=path):
+        with open(str(to), 'ab') as f:
+            f.write(data)
+    idle = []
+    watcher = _ScriptedWatcher(
+        lambda: append(b'a\nb'),
+        lambda: append(b'\nc\n'),
+        lambda: (path.rename(rotated), append(b'd\n')),
+        lambda: append(b'\xe2\x98'),
+        lambda: append(b'\x83\n'),
+        lambda: path.write_bytes(b'e\n'),
+        lambda: path.write_bytes(b''),
+        lambda: append(b'f\n'),
+    )
+    lines = readers.follow(str(path), encoding='utf-8', idle=lambda: idle.append(1),
+                           watcher=watcher)
+    assert next(lines) == ['a\n']
+    assert next(lines) == ['b\n', 'c\n']
+    assert next(lines) == ['d\n']
+    assert next(lines) == ['\u2603\n']
+    assert next(lines) == ['e\n']
+    assert next(lines) == ['f\n']
+    assert len(idle) == 8
+
+    path.write_bytes(b'x\n')
+    watcher.steps.append(lambda: append(b'y\xff\n'))
+    lines = readers.follow(str(path), binary=True, watcher=watcher)
+    assert next(lines) == [b'y\xff']
+
+
+@pytest.mark.parametrize('pattern', ['foo', 'ba', '.*', '(o+)$', r'\s*foo', r'\w+\n?fo', '$', 'x*'])
+@pytest.mark.parametrize('block_size', [1, 3, 100])
+def test_match_lines(pattern, block_size):
+    data = b'foo\nbar\r\nbaz foo\nfoo2\n\nlast foo'
+    p = re.compile(pattern)
+    expected = [p.match(l) for l in data.decode().replace('\r\n', '\n').split('\n')]
+    stream = io.TextIOWrapper(io.BytesIO(data))
+    got = list(readers.match_lines(stream, p, block_size))
+    assert [m and (m.string, m.span(), m.groups()) for m in got] == \
+        [m and (m.string, m.span(), m.groups()) for m in expected]
+
+    p = re.compile(pattern.encode())
+    expected = [p.match(l) for l in data.split(b'\n')]
+    got = list(readers.match_lines(io.BytesIO(data), p, block_size))
+    assert [m and (m.string, m.span()) for m in got] == \
+        [m and (m.string, m.span()) for m in expected]
+
+    got = list(readers.match_lines(io.BytesIO(data), p, block_size, filter=True))
+    assert got == [l for l in data.split(b'\n') if p.match(l)]
+
+
+@pytest.mark.parametrize('needle', ['foo', 'o', 'a', '', ' f', 'nope'])
+@pytest.mark.parametrize('block_size', [1, 3, 100])
+def test_find_lines(needle, block_size):
+    data = b'foo\nbar\r\nbaz foo\nfoo2\n\nlast foo'
+    stream = io.TextIOWrapper(io.BytesIO(data))
+    got = list(readers.find_lines(stream, needle, block_size))
+    assert got == [l for l in data.decode().replace('\r\n', '\n').split('\n') if needle in l]
+
+    got = list(readers.find_lines(io.BytesIO(data), needle.encode(), block_size))
+    assert got == [l for l in data.split(b'\n') if needle.encode() in l]
+
+    with pytest.raises(ValueError):
+        next(readers.find_lines(io.BytesIO(data), b'o\nb'))
+
+
+def test_scannable():
+    assert readers.scannable(re.compile(r'(?P<x>a)$'))
+    for pattern in [r'\Aa', r'a\Z', '(?<=a)b', 'a(?!b)', '(?s)a.b', b'a(?!b)']:
+        assert not readers.scannable(re.compile(pattern))
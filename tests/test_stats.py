@@ -0,0 +1,40 @@
+import io
+
+import spy
+from spy import stats
+
+
+@spy.fragment
+def drop_odd(v):
+    return spy.DROP if v % 2 else v
+
+
+@spy.fragment
+def double(v):
+    return spy.many([v, v])
+
+
+def test_profiler():
+    profiler = stats.Profiler()
+    chain = profiler.wrap(spy.chain([drop_odd, double], index_offset=-1))
+    assert list(chain.apply(range(10))) == [0, 0, 2, 2, 4, 4, 6, 6, 8, 8]
+    (_, first), (_, second) = profiler.steps
+    assert (first.items_in, first.items_out) == (10, 5)
+    assert (second.items_in, second.items_out) == (5, 10)
+    assert first.cumulative <= second.cumulative
+    out = io.StringIO()
+    profiler.report(out)
+    lines = out.getvalue().splitlines()
+    assert lines[0].strip().endswith('test_stats.drop_odd')
+    assert 'in 10, out 5 (50.0% dropped)' in lines[1]
+    assert lines[2].strip().startswith('1 |')
+    assert 'in 5, out 10 (x2.00)' in lines[3]
+
+
+def test_reservoir():
+    s = stats.StepStats()
+    s.max_samples = 10
+    for i in range(1000):
+        s.add_sample(i)
+    assert len(s.samples) == 10
+    assert s.percentile(0.99) == max(s.samples)